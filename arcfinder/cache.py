@@ -0,0 +1,140 @@
+import os
+import json
+import time
+import hashlib
+import fnmatch
+import numpy as np
+
+
+class SecondaryCache:
+    """
+    on-disk cache of computed secondary spectra. Every entry is a .npy file, which is loaded
+    memory-mapped, and a .json file with what it was computed from. The entries are addressed by
+    a hash of their key, so any change of the raw data or of a parameter gives a new entry.
+    The total size is kept below max_size by removing the least recently used entries.
+    """
+    def __init__(self, directory, max_size=2 * 1024 ** 3):
+        """
+        :param directory: directory of the cache, created if it doesn't exist
+        :param max_size: maximum size of all entries in bytes
+        """
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @staticmethod
+    def make_key(source, version, parameters):
+        """
+        :param source: identifies the raw data, e.g. the DB row or the path of the file
+        :param version: changes with the raw data, e.g. a modification time or a hash
+        :param parameters: everything else the result depends on, must have a stable repr
+        :return: the key of the entry
+        """
+        return hashlib.sha1(repr((source, version, parameters)).encode('utf-8')).hexdigest()
+
+    def __path(self, key, ext):
+        return os.path.join(self.directory, key + ext)
+
+    def load(self, key):
+        """
+        :param key: key of the entry (see make_key)
+        :return: the read-only memory-mapped array, or None if it isn't cached
+        """
+        path = self.__path(key, '.npy')
+        try:
+            data = np.load(path, mmap_mode='r')
+        except (IOError, OSError, ValueError):  # missing, or removed or truncated meanwhile
+            return None
+        os.utime(path, None)  # the modification time marks the last use
+        return data
+
+    def store(self, key, data, info=None):
+        """
+        adds an entry and removes the least recently used ones if the cache gets too large
+        :param key: key of the entry (see make_key)
+        :param data: numpy array
+        :param info: dict with a description of the entry (source, filename, parameters ...)
+        """
+        meta = dict(info or {}, shape=list(data.shape), dtype=str(data.dtype), created=time.time())
+        tmp = self.__path(key, '.{0}.tmp'.format(os.getpid()))
+        with open(tmp, 'wb') as f:  # written under another name first, so that nobody loads half a file
+            np.save(f, data)
+        with open(self.__path(key, '.json'), 'w') as f:
+            json.dump(meta, f, default=str)
+        os.replace(tmp, self.__path(key, '.npy'))
+        self.evict()
+
+    def entries(self):
+        """
+        :return: list of (key, size in bytes, time of last use) of all entries, least recently used first
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npy'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((name[:-4], st.st_size, st.st_mtime))
+        return sorted(entries, key=lambda e: e[2])
+
+    def info(self, key):
+        """
+        :return: the description of an entry (see store)
+        """
+        try:
+            with open(self.__path(key, '.json')) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def size(self):
+        """
+        :return: total size of the entries in bytes
+        """
+        return sum(e[1] for e in self.entries())
+
+    def remove(self, key):
+        for ext in ['.npy', '.json']:
+            try:
+                os.remove(self.__path(key, ext))
+            except OSError:
+                pass
+
+    def evict(self, max_size=None):
+        """
+        removes the least recently used entries until the cache is no larger than max_size
+        :param max_size: defaults to self.max_size
+        :return: number of removed entries
+        """
+        max_size = self.max_size if max_size is None else max_size
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        removed = 0
+        for key, size, _ in entries:
+            if total <= max_size:
+                break
+            self.remove(key)
+            total -= size
+            removed += 1
+        return removed
+
+    def invalidate(self, pattern=None):
+        """
+        removes entries
+        :param pattern: shell-style pattern matched against the filename and the source of the
+               entries, e.g. "*B0834*"; None removes all entries
+        :return: number of removed entries
+        """
+        removed = 0
+        for key, _, _ in self.entries():
+            if pattern is not None:
+                info = self.info(key)
+                names = [str(info.get('filename', '')), str(info.get('source', ''))]
+                if not any(fnmatch.fnmatch(name, pattern) for name in names):
+                    continue
+            self.remove(key)
+            removed += 1
+        return removed
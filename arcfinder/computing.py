@@ -1,8 +1,45 @@
+import os
+import shutil
+import hashlib
+import tempfile
 import multiprocessing as mp
+from collections import OrderedDict
 from .multiprocessing_helper_functions import *
 from astropy.io import fits
 
 import functions
+from . import preprocessing
+from .preprocessing import chunked_select, chunked_median
+
+try:
+    import scipy.fft
+
+    have_scipy = True
+except ImportError:
+    have_scipy = False
+try:
+    import pyfftw
+    import pyfftw.interfaces.cache
+    import pyfftw.interfaces.numpy_fft
+
+    pyfftw.interfaces.cache.enable()  # keeps the plans of recent transforms
+    pyfftw.interfaces.cache.set_keepalive_time(300)
+    have_pyfftw = True
+except ImportError:
+    have_pyfftw = False
+
+fft_backend = None  # 'pyfftw', 'scipy' or 'numpy', None takes the first one available
+fft_workers = 1  # threads per transform for scipy and pyfftw, -1 for all CPUs
+fft_pad = False  # compute awkward lengths with zero-padded FFTs of FFT-friendly lengths, see fft_along
+
+fft_backends = ('pyfftw', 'scipy', 'numpy')
+
+precision = 'double'  # floating point precision of the spectra, see set_precision
+precisions = {'single': (np.float32, np.complex64), 'double': (np.float64, np.complex128)}
+
+secondary_cache = None  # a cache.SecondaryCache to keep the secondary spectra on disk between runs
+
+preprocessing_profile = False  # measure the memory of the preprocessing stages (see Dynamic.preprocessing_report)
 
 
 def sort_dict_by_key(dictionary):
@@ -24,7 +61,8 @@ def arr_normalize_axis(arr, axis=None, mask=None):
     """
     normalizes array with respect to the given axis, making each row/column
     have the same mean within a specified region
-    :param arr: the array to be normalized
+    :param arr: the array to be normalized, changed in place. Stacks of arrays
+           (with the rows and columns in the last two axes) are normalized one by one
     :param axis: 'y' or 'x', will specify which axis to take as the chunks
            to be normalized
     :param mask: indicates which components of the given axis are priority.
@@ -39,47 +77,175 @@ def arr_normalize_axis(arr, axis=None, mask=None):
     """
     if axis is None:
         return arr
-    elif axis is 'y':
+    elif axis == 'y':
         if mask is None:
-            mask = [1.]*len(arr[0])
-        # not used:
-        # else:
-        #     for e in mask:
-        #         e = np.float(e)
-        mean = 0.
-        for row in arr:
-            mean += np.mean(mask * row)
-        mean /= float(len(arr))
-        for row in arr:
-            this_mean = np.mean(mask * row)
-            row *= mean / this_mean
+            row_means = np.mean(arr, axis=-1)
+        else:  # mean of mask * row for all rows in one reduction
+            row_means = np.dot(arr, np.asarray(mask, dtype=arr.dtype)) / arr.shape[-1]
+        mean = np.mean(row_means, axis=-1, keepdims=True)
+        arr *= (mean / row_means)[..., np.newaxis]
         return arr
-    elif axis is 'x':
-        return arr_normalize_axis(arr.T, axis='y', mask=mask).T
+    elif axis == 'x':
+        return np.swapaxes(arr_normalize_axis(np.swapaxes(arr, -1, -2), axis='y', mask=mask), -1, -2)
     else:
         raise Exception("invalid axis specification.")
 
 
-def repl_nonvals_wmed(array):
+def repl_nonvals_wmed(array, mask=None):
     """
     Replaces Non-values like NaN (and 0, because it makes trouble) with the median
     Median is computed only with values other than 0 and NaN
-    :param array: Numpy array
+    :param array: Numpy array, changed in place
+    :param mask: boolean array that is True at the non-values, if they are already known
     :return tuple of the array and the median
     """
-    index = np.where(np.logical_or(array < 0., array > 0.))
-    median = np.median(array[index])
-    for row in range(len(array)):
-        for col in range(len(array[row])):
-            if array[row][col] == 0 or np.isnan(array[row][col]):
-                array[row][col] = median
+    if mask is None:
+        mask = array == 0
+        mask |= np.isnan(array)
+    median = np.median(array[~mask], overwrite_input=True)  # array[~mask] is a copy already
+    np.putmask(array, mask, median)
     return array, median
 
 
+def set_fft_backend(backend=None, workers=None, pad=None):
+    """
+    selects how the FFTs of the secondary spectra are computed.
+    :param backend: 'pyfftw', 'scipy', 'numpy' or None for the first one of these that is installed
+    :param workers: number of threads per transform (-1 for all CPUs); numpy always uses one
+    :param pad: whether to compute the transforms of lengths that aren't FFT-friendly with
+           zero-padded FFTs of fast lengths (see fft_along)
+    """
+    global fft_backend, fft_workers, fft_pad
+    if backend is not None:
+        if backend not in fft_backends:
+            raise ValueError("unknown FFT backend '{0}', choose one of {1}".format(backend, ', '.join(fft_backends)))
+        if backend == 'pyfftw' and not have_pyfftw or backend == 'scipy' and not have_scipy:
+            raise ImportError("the FFT backend '{0}' is not installed".format(backend))
+        fft_backend = backend
+    if workers is not None:
+        if workers == 0 or workers < -1:
+            raise ValueError("workers must be a positive number or -1, not {0}".format(workers))
+        fft_workers = int(workers)
+    if pad is not None:
+        fft_pad = bool(pad)
+
+
+def set_precision(name):
+    """
+    sets the floating point precision in which dynamic and secondary spectra are processed.
+    'single' (float32/complex64) halves the memory of every stage. The secondary spectra then
+    differ from those in double precision by about 1e-4 dB (the statistics leave out the
+    zero-delay row, which holds only round-off); precision_check measures it for your data.
+    :param name: 'single' or 'double'
+    """
+    global precision
+    if name not in precisions:
+        raise ValueError("unknown precision '{0}', choose one of {1}".format(name, ', '.join(sorted(precisions))))
+    precision = name
+
+
+def real_dtype():
+    """
+    :return: the real numpy dtype of the current precision
+    """
+    return precisions[precision][0]
+
+
+def complex_dtype():
+    """
+    :return: the complex numpy dtype of the current precision
+    """
+    return precisions[precision][1]
+
+
+def get_fft_backend():
+    """
+    :return: the name of the FFT backend in use
+    """
+    if fft_backend is not None:
+        return fft_backend
+    elif have_pyfftw:
+        return 'pyfftw'
+    elif have_scipy:
+        return 'scipy'
+    return 'numpy'
+
+
+def next_fast_len(n):
+    """
+    :return: an FFT-friendly length >= n: scipy's choice if it is installed,
+             otherwise the smallest one that only has the prime factors 2, 3 and 5
+    """
+    if have_scipy:
+        return scipy.fft.next_fast_len(n)
+    best = 2 * n
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            p = p35
+            while p < n:
+                p *= 2
+            best = min(best, p)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+def backend_fft(kind, a, n, axis):
+    """
+    one-dimensional FFT with the backend chosen by set_fft_backend
+    :param kind: 'fft', 'ifft' or 'rfft' (for real input)
+    :param n: length of the transform, a is zero-padded or cropped to it
+    :return: the complex transform
+    """
+    backend = get_fft_backend()
+    if backend == 'pyfftw':
+        workers = mp.cpu_count() if fft_workers == -1 else fft_workers
+        return getattr(pyfftw.interfaces.numpy_fft, kind)(a, n, axis, threads=workers)
+    elif backend == 'scipy':
+        return getattr(scipy.fft, kind)(a, n, axis, workers=fft_workers)
+    return getattr(np.fft, kind)(a, n, axis)
+
+
+def fft_along(kind, a, axis, pad=None):
+    """
+    one-dimensional FFT along one axis with the backend chosen by set_fft_backend.
+    with padding, transforms of lengths that aren't FFT-friendly are computed with Bluestein's
+    algorithm, a convolution done with FFTs of a zero-padded fast length (next_fast_len). The result
+    is the same transform (up to round-off) on the same frequency axis, the padded arrays take two
+    to four times the memory of the input. Whether it is faster depends on the backend, numpy and
+    scipy already use the algorithm for large prime factors.
+    :param kind: 'fft' or 'rfft' (for real input)
+    :param a: numpy array
+    :param axis: axis to transform
+    :param pad: overrides fft_pad
+    :return: the complex transform, in the current precision
+    """
+    n = a.shape[axis]
+    if not (fft_pad if pad is None else pad) or next_fast_len(n) == n:
+        return backend_fft(kind, a, n, axis).astype(complex_dtype(), copy=False)
+    m = next_fast_len(2 * n - 1)
+    k = np.arange(n)
+    chirp = np.exp(-1j * np.pi * ((k * k) % (2 * n)) / n).astype(complex_dtype())  # exp(-i pi k^2 / n)
+    kernel = np.zeros(m, dtype=complex_dtype())
+    kernel[:n] = np.conj(chirp)
+    kernel[m - n + 1:] = np.conj(chirp[:0:-1])  # the negative indices of the convolution
+    shape = [1] * a.ndim
+    shape[axis] = -1
+    out = backend_fft('fft', a * chirp.reshape(shape), m, axis)
+    out *= backend_fft('fft', kernel, m, 0).reshape(shape)
+    out = backend_fft('ifft', out, m, axis)
+    out = np.take(out, k[:n // 2 + 1] if kind == 'rfft' else k, axis=axis)
+    out *= chirp[:out.shape[axis]].reshape(shape)
+    return out.astype(complex_dtype(), copy=False)
+
+
 class Dynamic:
     def __init__(self, data, db_header, filename=None, rotate=False):
         """
-        Initialize the dynamic spectrum class with a header and the corresponding dynamic spectrum
+        Initialize the dynamic spectrum class with a header and the corresponding dynamic spectrum.
+        The dynamic spectrum is only computed when it is first used (see get_dyn).
         :param data: the raw data
         :param rotate: rotate when handling local fits files
         """
@@ -89,9 +255,58 @@ class Dynamic:
         self.db_header = db_header
         self.filename = filename if filename else self.db_header['filename']
         self.rotate = rotate
-        self.dyn = self.get_dynamic_spectrum(data[0].data)
+        self._raw_data = data[0].data
+        self.dynamics = {}  # cache of get_dyn, by parameters
+        self._dyni = None
+        self.preprocessing_report = []  # time and memory of the stages of the last get_dynamic_spectrum
 
-        self.dyni = Indexed2D(data=self.dyn, axes=self.get_dyn_axes())
+    @property
+    def raw_data(self):
+        """
+        the raw data, as long as it isn't released (see drop_dynamic)
+        """
+        if self._raw_data is None:
+            raise ValueError('The raw data of {0} was released'.format(self.filename))
+        return self._raw_data
+
+    @property
+    def dyn(self):
+        """
+        the dynamic spectrum with the default parameters of get_dynamic_spectrum
+        """
+        return self.get_dyn()
+
+    @property
+    def dyni(self):
+        """
+        the dynamic spectrum as an Indexed2D, sharing its memory with dyn
+        """
+        if self._dyni is None:
+            self._dyni = Indexed2D(data=self.dyn, axes=self.get_dyn_axes())
+        return self._dyni
+
+    def get_dyn(self, normalize_frequency=False, normalize_time=True, outliers_sigma=9):
+        """
+        gives the dynamic spectrum, computing it only the first time it is asked for with these
+        parameters (and the current precision)
+        :return: the dynamic spectrum as a numpy array (see get_dynamic_spectrum)
+        """
+        key = (normalize_frequency, normalize_time, outliers_sigma, precision)
+        if key not in self.dynamics:
+            self.dynamics[key] = self.get_dynamic_spectrum(self.raw_data, normalize_frequency, normalize_time,
+                                                           outliers_sigma)
+        return self.dynamics[key]
+
+    def drop_dynamic(self, drop_raw=False):
+        """
+        frees the memory of the dynamic spectra computed so far. They will be computed again
+        from the raw data if they are used later on.
+        :param drop_raw: release the raw data as well, the dynamic spectra can't be computed any more then
+        """
+        self.dynamics = {}
+        self._dyni = None
+        if drop_raw:
+            self._raw_data = None
 
     def get_dynamic_spectrum(self, data, normalize_frequency=False, normalize_time=True, outliers_sigma=9):
         """
@@ -102,25 +317,13 @@ class Dynamic:
         :param normalize_time: if set to True, then will normalize the dynamic spectrum
                to compensate for uneven power in different time bins (vertically stripey)
         :param outliers_sigma:
-        :return: the dynamic spectrum as a numpy array
+        :return: the dynamic spectrum as a new numpy array, in the current precision (see set_precision)
         """
-        # dynamic = data
-        dynamic = np.rot90(data) if self.rotate else data
-        # dyn_mean = np.mean(dynamic)
-        # dyn_std = np.std(dynamic)
-        dynamic, dyn_median = repl_nonvals_wmed(dynamic)
-
-        dyn_med_std = np.std(dynamic - dyn_median)
-        # sets values 9 SDs above the mean and values less than 0 to 0
-        # index = np.where(np.logical_or(dynamic >= dyn_median + (float(outliers_sigma) * dyn_med_std), dynamic < 0.))
-        index = np.where(dynamic >= dyn_median + (float(outliers_sigma) * dyn_med_std))
-        dynamic[index] = dyn_median
-
-        if normalize_frequency:
-            dynamic = arr_normalize_axis(dynamic, 'y')
-        if normalize_time:
-            dynamic = arr_normalize_axis(dynamic, 'x')
-        return dynamic
+        # replaces non-values and outliers with the median and normalizes the axes, in few passes (see preprocessing)
+        pipeline = preprocessing.dynamic_pipeline(normalize_frequency, normalize_time, outliers_sigma)
+        dynamic = pipeline.run(data, self.rotate, real_dtype(), profile=preprocessing_profile)
+        self.preprocessing_report = pipeline.report
+        return dynamic  # a new array, data stays untouched for recomputing
 
     def get_dyn_axes(self):
         """
@@ -139,6 +342,75 @@ class Dynamic:
         time = list(np.linspace(0, t_int, nsubs))
         return frequency, time
 
+    def get_windowed_secondary(self, window, overlap=0.5, taper='hann', subtract_secondary_background=True,
+                               normalize_frequency=True, normalize_time=True, xscale=1., yscale=1., batch_size=16):
+        """
+        computes the secondary spectra of windows sliding along the time axis of the dynamic spectrum,
+        e.g. to follow how the curvature of the arcs changes during a long observation. The dynamic
+        spectrum is preprocessed once (see get_dyn), the windows are Fourier transformed as 3D stacks
+        with the real-input FFT and post-processed one by one like get_secondary_spectrum (with
+        cut_off_bottom).
+        :param window: length of the windows in subintegrations
+        :param overlap: fraction of a window that is shared with the next one (0 <= overlap < 1)
+        :param taper: 'hann', 'hamming', 'blackman', 'bartlett', None for none, or an array of
+               window weights; it is applied along the time axis after subtracting the mean of each window
+        :param batch_size: number of windows transformed at once, bounds the memory needed
+        :return: tuple of a numpy array (window, delay, fringe) and its axes (times of the window
+                 centres [s], delay axis, fringe frequency axis). SecondaryView(stack[i], axes[1], axes[2])
+                 gives a window for the curvature scans (see also scan_windowed_etas)
+        """
+        dynamic = self.dyn
+        nchans, nsubs = dynamic.shape
+        window = int(window)
+        if not 2 <= window <= nsubs:
+            raise ValueError('window must be between 2 and {0} subintegrations, not {1}'.format(nsubs, window))
+        if not 0 <= overlap < 1:
+            raise ValueError('overlap must be at least 0 and less than 1, not {0}'.format(overlap))
+        step = max(1, int(round(window * (1. - overlap))))
+        starts = np.arange(0, nsubs - window + 1, step)
+        if taper is None:
+            weights = None
+        elif isinstance(taper, str):
+            tapers = {'hann': np.hanning, 'hamming': np.hamming, 'blackman': np.blackman, 'bartlett': np.bartlett}
+            if taper not in tapers:
+                raise ValueError("unknown taper '{0}', choose one of {1}".format(taper, ', '.join(sorted(tapers))))
+            weights = tapers[taper](window).astype(dynamic.dtype)
+        else:
+            weights = np.asarray(taper, dtype=dynamic.dtype)
+            if weights.shape != (window,):
+                raise ValueError('the taper needs {0} weights, not {1}'.format(window, weights.size))
+
+        stack = None
+        # windows[:, :, i] is the window starting at subintegration i, without copying
+        windows = np.lib.stride_tricks.sliding_window_view(dynamic, window, axis=1)
+        for first in range(0, len(starts), batch_size):
+            batch = np.moveaxis(windows[:, starts[first:first + batch_size]], 1, 0)  # (windows, nchans, window)
+            batch = batch - np.mean(batch, axis=(-2, -1), keepdims=True)
+            if weights is not None:
+                batch *= weights
+            transform = fft_along('rfft', batch, 1)
+            del batch
+            transform = fft_along('fft', transform, 2)
+            for i in range(len(transform)):
+                secondary = half_plane_from_transform(transform[i], nchans, subtract_secondary_background,
+                                                      normalize_frequency, normalize_time, xscale, yscale)
+                if stack is None:
+                    stack = np.empty((len(starts),) + secondary.shape, dtype=secondary.dtype)
+                stack[first + i] = secondary
+            del transform
+
+        t_int = float(self.hdu_header["T_INT"])  # total integration time
+        BW = abs(float(self.hdu_header["BW"]))  # bandwidth
+        nyq_t = 1000. / (2. * t_int * window / nsubs)  # as in get_sec_axes, for the length of a window
+        nyq_f = nchans / (2. * BW)
+        fringe = np.linspace(-nyq_t, nyq_t, window)
+        delay = np.linspace(0, nyq_f, nchans // 2)[::-1]
+        xmin = int(window / 2. - window / (2. * xscale))  # the cropping of half_plane_postprocess
+        xmax = int(window / 2. + window / (2. * xscale))
+        ymin = int(nchans / 2. - nchans / (2. * yscale))
+        times = (starts + (window - 1) / 2.) * t_int / max(nsubs - 1, 1)
+        return stack, (list(times), list(delay[ymin:]), list(fringe[xmin:xmax]))
+
     def get_dyn_y_axis(self):
         return self.dyni.y_axis
 
@@ -167,18 +439,24 @@ class Indexed2D:
     the value of its axes. For instance, if you have an array that has 200 elements from
     -1 to 1 on the x axis, and 100 elements from 0 to 1 on the y axis, you can access the
     value of a point at y=-0.32 and x=0.57 by saying my_Indexed2D[-0.32,0.57]
+
+    numpy arrays are not copied: the Indexed2D (and everything sliced from it) shares
+    its memory with the array it was made from, unless copy=True is given or the dtype differs.
+    The dtype defaults to the current precision (see set_precision).
     """
-    def __init__(self, data=None, axes=None, dtype=float):
+    def __init__(self, data=None, axes=None, dtype=None, copy=False):
         self._is_data_set = False
         self._are_axes_set = False
         if data is None:
             self.data = np.array([[]])
         else:
-            self.set_data(data, dtype)
+            self.set_data(data, dtype, copy)
         if axes is None:
-            self.axes = ([], [])
-            self.y_axis = []
-            self.x_axis = []
+            self.y_axis = np.array([])
+            self.x_axis = np.array([])
+            self.axes = (self.y_axis, self.x_axis)
+            self._y_step = self._x_step = None
+            self._y_bounds = self._x_bounds = (np.nan, np.nan)
         else:
             self.set_axes(axes)
         return
@@ -188,79 +466,78 @@ class Indexed2D:
         x = tup[1]
         y_index = self.__get_y_index(y)
         x_index = self.__get_x_index(x)
-        return Indexed2D(data=self.data[y_index, x_index], axes=(self.y_axis[y_index], self.x_axis[x_index]))
+        # slices keep the result 2D and make it a view of this one
+        if type(y_index) is not slice:
+            y_index = slice(y_index, y_index + 1)
+        if type(x_index) is not slice:
+            x_index = slice(x_index, x_index + 1)
+        return Indexed2D(data=self.data[y_index, x_index], axes=(self.y_axis[y_index], self.x_axis[x_index]),
+                         dtype=self.data.dtype)
 
     def __get_y_index(self, value):
-        if type(value) == slice:
-            if value.start is not None:
-                if value.start < min(self.y_axis) or value.start > max(self.y_axis):
-                    raise IndexError('y axis index out of bounds: ' + str(value.start))
-                start_index = list(np.absolute([p - value.start for p in self.y_axis]))
-                start_index = start_index.index(min(start_index))
-            else:
-                start_index = 0
-            if value.stop is not None:
-                if value.stop < min(self.y_axis) or value.stop > max(self.y_axis):
-                    raise IndexError('y axis index out of bounds: ' + str(value.stop))
-                stop_index = list(np.absolute([p - value.stop for p in self.y_axis]))
-                stop_index = stop_index.index(min(stop_index))
-            else:
-                stop_index = len(self.y_axis) - 1
-            return slice(start_index, stop_index + 1)
-        else:
-            index = [p - value for p in self.y_axis]
-            index = index.index(min(index))
-            return index
+        return self.__get_index(value, self.y_axis, self._y_step, self._y_bounds, 'y')
 
     def __get_x_index(self, value):
+        return self.__get_index(value, self.x_axis, self._x_step, self._x_bounds, 'x')
+
+    @staticmethod
+    def __get_index(value, axis, step, bounds, name):
         if type(value) == slice:
             if value.start is not None:
-                if value.start < min(self.x_axis) or value.start > max(self.x_axis):
-                    raise IndexError('x axis index out of bounds: ' + str(value.start))
-                start_index = list(np.absolute([p - value.start for p in self.x_axis]))
-                start_index = start_index.index(min(start_index))
+                if value.start < bounds[0] or value.start > bounds[1]:
+                    raise IndexError('{0} axis index out of bounds: {1}'.format(name, value.start))
+                start_index = nearest_index(axis, value.start, step)
             else:
                 start_index = 0
             if value.stop is not None:
-                if value.stop < min(self.x_axis) or value.stop > max(self.x_axis):
-                    raise IndexError('x axis index out of bounds: ' + str(value.stop))
-                stop_index = list(np.absolute([p - value.stop for p in self.x_axis]))
-                stop_index = stop_index.index(min(stop_index))
+                if value.stop < bounds[0] or value.stop > bounds[1]:
+                    raise IndexError('{0} axis index out of bounds: {1}'.format(name, value.stop))
+                stop_index = nearest_index(axis, value.stop, step)
             else:
-                stop_index = len(self.x_axis) - 1
+                stop_index = len(axis) - 1
+            if start_index > stop_index:  # descending axis
+                start_index, stop_index = stop_index, start_index
             return slice(start_index, stop_index + 1)
         else:
-            index = [p - value for p in self.x_axis]
-            index = index.index(min(index))
-            return index
+            return nearest_index(axis, value, step)
+
+    def get_y_index(self, value):
+        """
+        gives the index of the y axis sample closest to value
+        :param value: a number or an array of numbers
+        :return: index or numpy array of indices
+        """
+        return nearest_index(self.y_axis, value, self._y_step)
+
+    def get_x_index(self, value):
+        """
+        gives the index of the x axis sample closest to value
+        :param value: a number or an array of numbers
+        :return: index or numpy array of indices
+        """
+        return nearest_index(self.x_axis, value, self._x_step)
 
-    def set_data(self, data, dtype=float):
-        if type(data) is not list and type(data) is not np.ndarray:
+    def set_data(self, data, dtype=None, copy=False):
+        if dtype is None:
+            dtype = real_dtype()
+        if type(data) is not list and not isinstance(data, np.ndarray):  # memmaps are ndarrays too
             raise TypeError('Data does not have the right type.')
-        for d in data:
-            if len(d) != len(data[0]):
-                raise IndexError('Data must be rectangular in shape.')
-        for d in data:
-            if type(d) is not list and type(d) is not np.ndarray:
-                raise TypeError('Data does not have the right type.')
-            for i in range(len(d)):
-                if d[i] is not dtype:
-                    try:
-                        d[i] = dtype(d[i])
-                    except Exception as e:
-                        print('your data could not be casted to ' + str(dtype) + ': ')
-                        raise e
+        if type(data) is list and len(set(len(d) for d in data)) > 1:
+            raise IndexError('Data must be rectangular in shape.')
+        try:
+            data = np.array(data, dtype=dtype) if copy else np.asarray(data, dtype=dtype)
+        except (TypeError, ValueError) as e:
+            print('your data could not be casted to ' + str(dtype) + ': ')
+            raise e
+        if data.ndim != 2:
+            raise IndexError('Data must be rectangular in shape.')
         if self._are_axes_set:
-            y_axis_matching = len(data) == len(self.y_axis)
-            x_axis_matching = len(data[0]) == len(self.x_axis)
-            if y_axis_matching and x_axis_matching:
-                self._is_data_set = True
-                self.data = np.array(data)
-            else:
+            y_axis_matching = data.shape[0] == len(self.y_axis)
+            x_axis_matching = data.shape[1] == len(self.x_axis)
+            if not (y_axis_matching and x_axis_matching):
                 raise IndexError('Data must have dimensions as axes')
-        else:
-            self._is_data_set = True
-            self.data = np.array(data)
+        self._is_data_set = True
+        self.data = data
         return
 
     def set_axes(self, axes):
@@ -272,32 +549,46 @@ class Indexed2D:
             raise TypeError('The axes should be specified with a list or numpy array')
         if type(x_axis) is not list and type(x_axis) is not np.ndarray:
             raise TypeError('The axes should be specified with a list or numpy array')
-        for i in range(len(y_axis)):
-            if type(y_axis[i]) is not float:
-                y_axis[i] = float(y_axis[i])
-        for i in range(len(x_axis)):
-            if type(x_axis[i]) is not float:
-                x_axis[i] = float(x_axis[i])
+        y_axis = np.asarray(y_axis, dtype=float)
+        x_axis = np.asarray(x_axis, dtype=float)
+        if y_axis.ndim != 1 or x_axis.ndim != 1:
+            raise TypeError('The axes should be one-dimensional')
         if self._is_data_set:
-            y_axis_matching = len(y_axis) == len(self.data)
-            x_axis_matching = len(x_axis) == len(self.data[0])
-            if y_axis_matching and x_axis_matching:
-                self._are_axes_set = True
-                self.axes = (y_axis, x_axis)
-                self.x_axis = x_axis
-                self.y_axis = y_axis
-            else:
+            y_axis_matching = len(y_axis) == self.data.shape[0]
+            x_axis_matching = len(x_axis) == self.data.shape[1]
+            if not (y_axis_matching and x_axis_matching):
                 raise IndexError('Axes must have dimensions as data (y: {0}!={1}, x: {2}!={3})'.format(
-                        len(y_axis), len(self.data), len(x_axis), len(self.data[0])))
-        else:
-            self._are_axes_set = True
-            self.x_axis = x_axis
-            self.y_axis = y_axis
-            self.axes = (y_axis, x_axis)
+                        len(y_axis), self.data.shape[0], len(x_axis), self.data.shape[1]))
+        self._are_axes_set = True
+        self.y_axis = y_axis
+        self.x_axis = x_axis
+        self.axes = (y_axis, x_axis)
+        # spacing and range of the axes, for looking up indices by value
+        self._y_step = axis_step(y_axis)
+        self._x_step = axis_step(x_axis)
+        self._y_bounds = (y_axis.min(), y_axis.max()) if len(y_axis) else (np.nan, np.nan)
+        self._x_bounds = (x_axis.min(), x_axis.max()) if len(x_axis) else (np.nan, np.nan)
         return
 
-    def get_data(self):
-        return np.array(self.data)
+    def get_data(self, copy=False):
+        """
+        gives the data array
+        :param copy: return a (writable) copy instead of a read-only view
+        :return: 2D numpy array
+        """
+        if copy:
+            return np.array(self.data)
+        view = self.data.view()
+        view.flags.writeable = False
+        return view
+
+    def copy(self):
+        """
+        gives an Indexed2D with copies of the data and the axes
+        :return: Indexed2D object
+        """
+        return Indexed2D(data=self.data, axes=(np.array(self.y_axis), np.array(self.x_axis)), dtype=self.data.dtype,
+                         copy=True)
 
     def get_axes(self):
         return self.axes
@@ -313,7 +604,8 @@ class Indexed2D:
 class Secondary(Dynamic):  # Secondary inherits the Dynamic class
     def __init__(self, data, db_header, filename=None, rotate=False, hand=None):
         """
-        initialize me with an dynamic object
+        initialize me with an dynamic object. Like the dynamic spectrum, the secondary spectrum is
+        only computed when it is first used.
         :param data:
         :param hand:
         :return:
@@ -321,13 +613,13 @@ class Secondary(Dynamic):  # Secondary inherits the Dynamic class
         functions.check_object_type(data, fits.HDUList)
 
         Dynamic.__init__(self, data, db_header, filename, rotate)
-        data = self.get_secondary_spectrum()
-        axes = self.get_sec_axes()
-
-        self.sec = Indexed2D(data=data, axes=axes)
+        self.secondaries = {}  # cache of get_secondary_spectrum, by parameters
+        self._sec = None
+        self._source = None  # see get_source
         self.hand = hand
         self.made_1D = False
         self.parabola_power = {}
+        self.power_maps = {}  # cache of get_power_map
         self.observation_name = filename
         self.band = str(self.observation_name)
 
@@ -339,10 +631,25 @@ class Secondary(Dynamic):  # Secondary inherits the Dynamic class
         """
         return self.sec[value]
 
+    @property
+    def sec(self):
+        """
+        the secondary spectrum as an Indexed2D: the one of get_secondary_spectrum with the default
+        parameters, or whatever (e.g. a cropped version) was assigned to it since
+        """
+        if self._sec is None:
+            self._sec = Indexed2D(data=self.get_secondary_spectrum(), axes=self.get_sec_axes())
+        return self._sec
+
+    @sec.setter
+    def sec(self, value):
+        self._sec = value
+
     def get_secondary_spectrum(self, subtract_secondary_background=True, normalize_frequency=True, normalize_time=True,
-                               cut_off_bottom=True, xscale=1., yscale=1.):
+                               cut_off_bottom=True, xscale=1., yscale=1., real_input=True):
         """
-        returns a secondary spectrum given a dynamic spectrum.
+        returns a secondary spectrum given a dynamic spectrum. It is computed only the first time it
+        is asked for with these parameters (and the current precision), and shared afterwards.
         :param subtract_secondary_background: whether or not to subtract the background
                to improve contrast. Points without signal will have a mean of 0,
                the points with meaningful data will have a mean higher than 0.
@@ -351,22 +658,118 @@ class Secondary(Dynamic):  # Secondary inherits the Dynamic class
         :param cut_off_bottom: whether to cut off the "mirror image" bottom half of the secondary spectrum
         :param xscale: the multiplicative scale by which to cut down x
         :param yscale: the multiplicative scale by which to cut down y
-        :return: a numpy array containing the secondary spectrum
+        :param real_input: together with cut_off_bottom, compute only the kept half of the spectrum
+               with a real-input FFT (see half_plane_from_transform), which needs about half the
+               time and memory of the full transform. The FFTs use the backend chosen by set_fft_backend.
+        :return: a read-only numpy array containing the secondary spectrum (use np.array(...) to change it)
+        """
+        key = self.secondary_key(subtract_secondary_background, normalize_frequency, normalize_time, cut_off_bottom,
+                                 xscale, yscale, real_input)
+        if not self.load_secondary(key):
+            self.store_secondary(key, self.__secondary_spectrum(*key[:-1]))
+        view = self.secondaries[key].view()  # the memoized array is shared, it mustn't be changed
+        view.flags.writeable = False
+        return view
+
+    @staticmethod
+    def secondary_key(subtract_secondary_background=True, normalize_frequency=True, normalize_time=True,
+                      cut_off_bottom=True, xscale=1., yscale=1., real_input=True):
+        """
+        :return: the key of a secondary spectrum in self.secondaries (the parameters of
+                 get_secondary_spectrum and the current precision)
+        """
+        return (subtract_secondary_background, normalize_frequency, normalize_time, cut_off_bottom, xscale, yscale,
+                real_input, precision)
+
+    def __cache_key(self, key):
+        source, version = self.get_source()
+        # the dynamic spectrum is the one of get_dyn with the default parameters
+        parameters = key + (self.rotate, fft_pad, Dynamic.get_dyn.__defaults__)
+        info = {'source': source, 'version': version, 'filename': self.filename, 'parameters': parameters}
+        return secondary_cache.make_key(source, version, parameters), info
+
+    def load_secondary(self, key):
+        """
+        looks a secondary spectrum up in self.secondaries and then in secondary_cache
+        :param key: see secondary_key
+        :return: whether it is in self.secondaries now
+        """
+        if key not in self.secondaries and secondary_cache is not None:
+            data = secondary_cache.load(self.__cache_key(key)[0])
+            if data is not None:
+                self.secondaries[key] = data
+        return key in self.secondaries
+
+    def store_secondary(self, key, data):
         """
+        keeps a computed secondary spectrum in self.secondaries and in secondary_cache
+        :param key: see secondary_key
+        :param data: the secondary spectrum as returned by get_secondary_spectrum
+        """
+        if secondary_cache is not None:
+            cache_key, info = self.__cache_key(key)
+            secondary_cache.store(cache_key, data, info)
+        self.secondaries[key] = data
+
+    def get_secondary_spectrum_out_of_core(self, out_path=None, ram_limit=2 ** 30, workdir=None, **kwargs):
+        """
+        like get_secondary_spectrum, but computed with secondary_out_of_core, so that neither the
+        dynamic spectrum nor its FFT have to fit into memory. Open the FITS file with memmap=True
+        for the raw data not to be read at once either.
+        :param out_path: .npy file for the result (default: a temporary file that is removed when
+               the result is no longer used)
+        :param ram_limit: approximate number of bytes the chunks may take
+        :param workdir: directory for temporary files (default: the system's)
+        :param kwargs: parameters of get_secondary_spectrum, with cut_off_bottom and real_input
+        :return: a numpy array (memory map) containing the secondary spectrum
+        """
+        key = self.secondary_key(**kwargs)
+        if not (key[3] and key[6]):
+            raise ValueError('Out of core, only the cut off secondary spectrum of the real-input FFT is computed')
+        if not self.load_secondary(key):
+            temporary = out_path is None
+            if temporary:
+                fd, out_path = tempfile.mkstemp('.npy', dir=workdir)
+                os.close(fd)
+            report = []
+            data = secondary_out_of_core(self.raw_data, out_path, self.rotate, ram_limit, workdir, None,
+                                         *key[:3], xscale=key[4], yscale=key[5], report=report)
+            self.preprocessing_report = report
+            if temporary:
+                try:
+                    os.remove(out_path)  # the memory map stays valid (on POSIX systems)
+                except OSError:
+                    pass
+            self.store_secondary(key, data)
+        view = self.secondaries[key].view()  # read-only, like get_secondary_spectrum
+        view.flags.writeable = False
+        return view
+
+    def __secondary_spectrum(self, subtract_secondary_background, normalize_frequency, normalize_time,
+                             cut_off_bottom, xscale, yscale, real_input):
         dynamic = self.dyn
         dynamic = dynamic - np.mean(dynamic)
-        secondary = np.fft.fftn(dynamic)
+        if real_input and cut_off_bottom:
+            transform = fft_along('rfft', dynamic, 0)
+            del dynamic
+            transform = fft_along('fft', transform, 1)
+            return half_plane_from_transform(transform, len(self.dyn), subtract_secondary_background,
+                                             normalize_frequency, normalize_time, xscale, yscale)
+        secondary = fft_along('fft', fft_along('fft', dynamic, 0), 1)
 
         secondary, sec_median = repl_nonvals_wmed(secondary)
 
         # secondary /= secondary.max()
         secondary = np.abs(np.fft.fftshift(secondary))**2
         secondary = 10. * np.log10(secondary/np.max(secondary))  # in decibels
+        # the zero-delay row only holds round-off, it is left out of the statistics (see half_plane_postprocess)
+        rows = np.arange(len(secondary)) != len(secondary) // 2
 
         if normalize_frequency:
             mask = [1. if i < len(secondary[0]) / 4. or i > 3 * len(secondary[0]) / 4. else 0. for i in
                     range(len(secondary[0]))]
-            secondary = arr_normalize_axis(secondary, 'y', mask)
+            row_means = np.dot(secondary, np.asarray(mask, dtype=secondary.dtype)) / len(secondary[0])
+            secondary *= (np.mean(row_means[rows]) / row_means)[:, np.newaxis]
         if normalize_time:
             mask = [1. if i < len(secondary) / 4. else 0. for i in range(len(secondary))]
             secondary = arr_normalize_axis(secondary, 'x', mask)
@@ -374,11 +777,13 @@ class Secondary(Dynamic):  # Secondary inherits the Dynamic class
             # secondary_background = np.mean(secondary[:len(secondary) / 4][:len(secondary[0]) / 4])
             # secondary = secondary - secondary_background
             nbins = 25
-            histSec = np.histogram(secondary, bins=nbins)
-            binsize = (np.max(secondary)-np.min(secondary))//nbins
+            statistics = secondary[rows]
+            histSec = np.histogram(statistics, bins=nbins)
+            binsize = (np.max(statistics)-np.min(statistics))//nbins
             maxindex = np.where(histSec[0] == np.max(histSec[0]))  # where frequency of occurences is highest
-            xVal = int(maxindex[0])  # position of peak in noise
-            xValDb = np.min(secondary)+binsize*xVal+3.  # value of peak in noise offset up by 3Db
+            xVal = int(maxindex[0][0])  # position of peak in noise
+            xValDb = np.min(statistics)+binsize*xVal+3.  # value of peak in noise offset up by 3Db
+            del statistics
             index = np.where(secondary < xValDb)
             if index != -1:  # if there are values less than threshold value
                 secondary[index] = xValDb
@@ -398,6 +803,33 @@ class Secondary(Dynamic):  # Secondary inherits the Dynamic class
 
         return secondary[ymin:ymax, xmin:xmax]
 
+    def drop_dynamic(self, drop_raw=False):
+        if drop_raw and secondary_cache is not None:
+            self.get_source()  # it may be a hash of the raw data
+        Dynamic.drop_dynamic(self, drop_raw)
+
+    drop_dynamic.__doc__ = Dynamic.drop_dynamic.__doc__
+
+    def get_source(self):
+        """
+        identifies the raw data of the secondary spectrum, for secondary_cache. It is only
+        determined once, the raw data may be released afterwards (see drop_dynamic).
+        :return: tuple of the source (DB row or file) and its version (modification time or hash)
+        """
+        if self._source is None:
+            keys = list(self.db_header.keys())
+            if 'id' in keys and 'mtime' in keys:  # row of the database
+                # mtime has a resolution of a second, the file the row was ingested from tells changes apart
+                version = ':'.join(str(self.db_header[key]) for key in ['mtime', 'file_size', 'file_mtime', 'file_hash']
+                                   if key in keys)
+                self._source = 'db:{0}:{1}'.format(self.db_header['id'], self.filename), version
+            elif os.path.isfile(self.filename):
+                stat = os.stat(self.filename)
+                self._source = os.path.abspath(self.filename), '{0}:{1}'.format(stat.st_mtime, stat.st_size)
+            else:
+                self._source = self.filename, hashlib.sha1(np.ascontiguousarray(self.raw_data).tobytes()).hexdigest()
+        return self._source
+
     def get_sec_axes(self):
         """
         finds the axes that correspond to the secondary spectrum plot.
@@ -413,11 +845,71 @@ class Secondary(Dynamic):  # Secondary inherits the Dynamic class
         nyq_t = 1000. / (2. * t_int)  # nyquist frequency for the delay axis of the secondary spectrum
         nyq_f = nchans / (2. * BW)  # nyquist frequency for the fringe frequency axis of the secondary spectrum
         fringe = list(np.linspace(-nyq_t, nyq_t, naxis2))
-        delay = list(reversed(np.linspace(0, nyq_f, nchans / 2.)))
+        delay = list(reversed(np.linspace(0, nyq_f, nchans // 2)))
         return delay, fringe
 
     def get(self, value):
-        return self.sec.get_data().item(tuple(value))
+        return self.sec.data.item(tuple(value))
+
+    def scan_etas(self, etas, sigma=None, processes=None, chunksize=None):
+        """
+        computes the power along parabolas of the given curvatures (see crunchy),
+        spread over a pool of processes
+        :param etas: list of curvatures
+        :param sigma: [y, x] widths of the weighting, defaults to one pixel
+        :param processes: number of worker processes, defaults to the number of CPUs
+        :param chunksize: number of etas per task
+        :return: list of (eta, power) tuples, in the order of etas
+        """
+        return parallel_crunch('eta', etas, self, processes, chunksize, sigma=sigma)
+
+    def scan_offsets(self, offsets, eta, sigma=None, processes=None, chunksize=None):
+        """
+        computes the power along shifted parabolas of curvature eta (see crunchy3),
+        spread over a pool of processes
+        :param offsets: list of x-offsets of the parabola apex
+        :param eta: curvature
+        :param sigma: [y, x] widths of the weighting, defaults to one pixel
+        :param processes: number of worker processes, defaults to the number of CPUs
+        :param chunksize: number of offsets per task
+        :return: list of (offset, power) tuples, in the order of offsets
+        """
+        return parallel_crunch('offset', offsets, self, processes, chunksize, eta=eta, sigma=sigma)
+
+    def search_eta(self, eta_range, num_coarse=25, num_peaks=3, tol=1e-3, sigma=None):
+        """
+        finds the curvature of the strongest arc with a coarse scan followed by a
+        golden-section refinement of the best peaks (see search_eta in the helper functions)
+        :param eta_range: (eta_min, eta_max)
+        :param num_coarse: number of etas in the coarse grid
+        :param num_peaks: number of coarse maxima to refine
+        :param tol: relative precision of eta
+        :param sigma: [y, x] widths of the weighting, defaults to one pixel
+        :return: tuple of the best eta, its power, the number of evaluations and all (eta, power) pairs
+        """
+        return search_eta(self, eta_range, num_coarse, num_peaks, tol, sigma)
+
+    def get_offset_eta_plane(self, offsets, etas, sigma=None, band=True):
+        """
+        computes the power along shifted parabolas for all combinations of offsets and etas
+        (see crunchy3_grid)
+        :param offsets: list of x-offsets of the parabola apex
+        :param etas: list of curvatures
+        :param sigma: [y, x] widths of the weighting, defaults to one pixel
+        :param band: evaluate only the pixels around each parabola, see crunchy3_grid
+        :return: numpy array (len(offsets), len(etas))
+        """
+        return crunchy3_grid(offsets, etas, self, sigma, band)
+
+    def scan_points(self, pts_and_sigmas, processes=None, chunksize=None):
+        """
+        computes the weighted power around points (see crunchy2), spread over a pool of processes
+        :param pts_and_sigmas: list of ((py, px), sigma) tuples
+        :param processes: number of worker processes, defaults to the number of CPUs
+        :param chunksize: number of points per task
+        :return: list of ((py, px), power) tuples, in the order of pts_and_sigmas
+        """
+        return parallel_crunch('point', pts_and_sigmas, self, processes, chunksize)
 
     def get_y_axis(self):
         """
@@ -447,6 +939,7 @@ class Secondary(Dynamic):  # Secondary inherits the Dynamic class
         y_max = max(self.sec.get_y_axis())
         x_max = max(self.sec.get_x_axis())
         self.sec = self.sec[y_max * y_scale:, -x_max * x_scale:x_max * x_scale]
+        self.power_maps = {}
         return
 
     def crop(self, y_lim, x_lim):
@@ -460,43 +953,400 @@ class Secondary(Dynamic):  # Secondary inherits the Dynamic class
         :return:
         """
         self.sec = self.sec[float(y_lim[0]):float(y_lim[1]), float(x_lim[0]):float(x_lim[1])]
+        self.power_maps = {}
 
-    def get_sec(self):
+    def get_sec(self, copy=False):
         """
         gives sec as a numpy 2D array
+        :param copy: return a writable copy instead of a read-only view
         :return:
         """
-        return self.sec.get_data()
+        return self.sec.get_data(copy)
+
+    def get_power_map(self, sigma=None):
+        """
+        gives the weighted mean power around every pixel (the crunchy2 power of all points at once)
+        :param sigma: [y, x] widths of the Gaussian weighting, defaults to (and at least) one pixel
+        :return: 2D numpy array with the axes of the secondary spectrum
+        """
+        return get_power_map(self, sigma)
+
+    def get_power_maps(self, sigmas):
+        """
+        like get_power_map, for several sigmas at once
+        :param sigmas: list of [y, x] widths
+        :return: numpy array (len(sigmas), y, x)
+        """
+        return power_maps(self.sec.data, self.get_y_axis(), self.get_x_axis(), sigmas)
+
+    def make_1D_by_quadratic(self, etas, xrange=(-np.inf, np.inf), yrange=(0., np.inf), mask=(3, 0, 0), max_t=5):
+        """
+        computes the mean power along parabolas y = eta * x^2 for all given etas (see Parabola).
+        The results are stored in self.etas and self.powers.
+        :param etas: list of curvatures
+        :param xrange: range of x-values to consider (x_min, x_max) [mHz]
+        :param yrange: range of y-values to consider (y_min, y_max) [us]
+        :param mask: data points <= than this many pixels from origin/x-axis/y-axis will be masked
+        :param max_t: max parabola thickness in pixels
+        :return: tuple of the etas and the powers
+        """
+        parabola = get_parabola(self, etas, xrange, yrange, mask, max_t)
+        self.etas = parabola.etas
+        self.powers = list(parabola.power(self.sec.data))
+        self.made_1D = True
+        return self.etas, self.powers
+
+
+def half_plane_from_transform(transform, ny, subtract_secondary_background=True, normalize_frequency=True,
+                              normalize_time=True, xscale=1., yscale=1.):
+    """
+    computes the top half of the secondary spectrum (what get_secondary_spectrum returns with
+    cut_off_bottom) from the half-plane transform of the dynamic spectrum.
+    :param transform: real-input FFT of the (mean subtracted) dynamic spectrum along axis 0,
+           followed by a complex FFT along axis 1; shape (ny // 2 + 1, nx). Non-values are
+           replaced in place.
+    :param ny: number of rows (frequency channels) of the dynamic spectrum
+    :return: a numpy array containing the secondary spectrum
+    """
+    transform, sec_median = repl_nonvals_wmed(transform)
+    power = np.abs(transform)**2
+    nh = ny // 2
+    nx = power.shape[1]
+    # row m of the transform is delay -m of the secondary spectrum for fringe frequency -k,
+    # so the kept rows are the transform rows nh..1 with their columns mirrored (and fftshifted)
+    half = power[nh:0:-1][:, (nx // 2 - np.arange(nx)) % nx]
+    p_max = np.max(power)
+    del power
+    np.divide(half, p_max, out=half)
+    np.log10(half, out=half)
+    half *= 10.  # in decibels
+    return half_plane_postprocess(half, ny, subtract_secondary_background, normalize_frequency,
+                                  normalize_time, xscale, yscale)
+
+
+def half_plane_postprocess(half, ny, subtract_secondary_background=True, normalize_frequency=True,
+                           normalize_time=True, xscale=1., yscale=1., chunk_rows=None):
+    """
+    does the normalization, background subtraction and cropping of get_secondary_spectrum on the
+    top half of a secondary spectrum only. The statistics still cover the whole plane: for a real
+    dynamic spectrum the bottom half is the point mirror of the top half, apart from the zero-delay
+    row, so the bottom rows are reconstructed from the top half where they are needed.
+    The zero-delay row itself is left out of the statistics: the columns of the dynamic spectrum
+    are normalized to the same mean, so it holds nothing but the round-off of the FFT, which
+    depends on the precision and would otherwise set the range of the background histogram.
+    This changed the output in double precision as well: with the row in the statistics, the
+    background level and the dB range were typically several dB lower.
+    :param half: top half of the secondary spectrum in dB (ny // 2 rows); changed in place
+    :param ny: number of rows of the whole secondary spectrum
+    :param chunk_rows: how many bottom rows are reconstructed at a time (default: all)
+    :return: the cropped secondary spectrum, a view of half
+    """
+    nh, nx = half.shape
+    nb = ny - nh  # number of bottom rows, the first one is the zero-delay row
+    mirrored = nh - np.arange(1, nb)  # bottom row k (k >= 1) is the mirror of row nh - k of half
+    flip = (2 * (nx // 2) - np.arange(nx)) % nx  # mirrors the (fftshifted) columns
+    row_scale = np.ones(nh)
+    bottom_scale = np.ones(nb)
+    col_scale = np.ones(nx)
+
+    if normalize_frequency:
+        mask = np.array([1. if i < nx / 4. or i > 3 * nx / 4. else 0. for i in range(nx)], dtype=half.dtype)
+        means = np.dot(half, mask) / nx
+        bottom_means = np.concatenate(([1.], (np.dot(half, mask[flip]) / nx)[mirrored]))
+        mean = (np.sum(means) + np.sum(bottom_means[1:])) / (ny - 1)  # without the zero-delay row
+        row_scale = mean / means
+        bottom_scale = mean / bottom_means
+        half *= row_scale[:, np.newaxis]
+    if normalize_time:
+        mask = np.array([1. if i < ny / 4. else 0. for i in range(nh)], dtype=half.dtype)  # all in half
+        means = np.dot(mask, half) / ny
+        col_scale = np.mean(means) / means
+        half *= col_scale
+    if subtract_secondary_background:
+        def bottom_rows():  # without the zero-delay row
+            step = chunk_rows if chunk_rows else max(nb, 1)
+            for start in range(1, nb, step):
+                k = np.arange(start, min(start + step, nb))
+                rows = mirrored[k - 1]
+                chunk = half[rows][:, flip]
+                # swap the scales of the mirrored rows for those of the bottom rows
+                chunk *= (bottom_scale[k] / row_scale[rows])[:, np.newaxis]
+                chunk *= col_scale / col_scale[flip]
+                yield chunk
+
+        nbins = 25
+        s_min, s_max = np.min(half), np.max(half)
+        for chunk in bottom_rows():
+            s_min, s_max = min(s_min, np.min(chunk)), max(s_max, np.max(chunk))
+        histSec = np.histogram(half, bins=nbins, range=(s_min, s_max))[0]
+        for chunk in bottom_rows():
+            histSec += np.histogram(chunk, bins=nbins, range=(s_min, s_max))[0]
+        binsize = (s_max-s_min)//nbins
+        xVal = int(np.argmax(histSec))  # position of peak in noise
+        xValDb = s_min+binsize*xVal+3.  # value of peak in noise offset up by 3Db
+        np.maximum(half, xValDb, out=half)
+
+    xmin = int(nx / 2. - nx / (2. * xscale))
+    xmax = int(nx / 2. + nx / (2. * xscale))
+    ymin = int(ny / 2. - ny / (2. * yscale))
+    return half[ymin:nh, xmin:xmax]
+
+
+def transpose_tiled(source, target, tile):
+    """
+    writes the transpose of a 2D array into another one in square tiles, so that both are read
+    and written in runs of tile elements, e.g. from and to memory maps
+    :param source: 2D array
+    :param target: 2D array of the transposed shape
+    :param tile: edge length of the tiles
+    """
+    n, m = source.shape
+    for i in range(0, n, tile):
+        for j in range(0, m, tile):
+            target[j:j + tile, i:i + tile] = source[i:i + tile, j:j + tile].T
+
+
+def secondary_out_of_core(data, out_path, rotate=False, ram_limit=2 ** 30, workdir=None, dyn_parameters=None,
+                          subtract_secondary_background=True, normalize_frequency=True, normalize_time=True,
+                          xscale=1., yscale=1., report=None):
+    """
+    computes the secondary spectrum of get_secondary_spectrum (with the real-input half plane) for
+    dynamic spectra larger than the memory. The data is only read in chunks, e.g. from a memory
+    map (a FITS file opened with memmap=True or np.load(..., mmap_mode='r')):
+    - the dynamic spectrum is cleaned by the pipeline of get_dynamic_spectrum into a temporary
+      file, with the median taken by chunked_median (see preprocessing)
+    - the 2D FFT is done as two passes of 1D FFTs over blocks of rows: the cleaned spectrum is
+      transposed for the FFT along the frequency axis and the result transposed back for the
+      one along the time axis (see transpose_tiled), so every pass reads contiguous rows
+    - the power is written to a memory-mapped .npy file and post-processed there in chunks
+      (see half_plane_postprocess)
+    :param data: 2D array of the raw dynamic spectrum
+    :param out_path: the .npy file for the secondary spectrum
+    :param rotate: see Dynamic
+    :param ram_limit: approximate number of bytes the chunks may take
+    :param workdir: directory for the temporary files (default: the system's)
+    :param dyn_parameters: (normalize_frequency, normalize_time, outliers_sigma) of get_dynamic_spectrum,
+           defaults to the ones of get_dyn
+    :param report: list that gets the report of the preprocessing (see Dynamic.preprocessing_report)
+    :return: the cropped secondary spectrum, a view of the memory-mapped file
+    """
+    ny, nx = np.shape(data)[::-1] if rotate else np.shape(data)
+    nh = ny // 2
+    dyn_normalize_frequency, dyn_normalize_time, outliers_sigma = dyn_parameters or Dynamic.get_dyn.__defaults__
+    # a chunk takes about six complex numbers per element: input, cleaned copy, masks and the transforms
+    item = 6 * np.dtype(complex_dtype()).itemsize
+    rows = int(max(1, min(ny, ram_limit // (nx * item))))
+    cols = int(max(1, min(nx, ram_limit // (ny * item))))  # rows of the transposed arrays
+    tile = int(max(1, np.sqrt(ram_limit // item)))
+
+    def temporary(name, dtype, shape):
+        return np.lib.format.open_memmap(os.path.join(tmpdir, name), 'w+', dtype, shape)
+
+    def discard(name):  # frees the disk space early, once the memory map is deleted
+        try:
+            os.remove(os.path.join(tmpdir, name))
+        except OSError:
+            pass
+
+    tmpdir = tempfile.mkdtemp(dir=workdir)
+    try:
+        dyn = temporary('dynamic.npy', real_dtype(), (ny, nx))
+        if rotate:  # np.rot90(data) is data transposed, with the columns in reverse order
+            transpose_tiled(data[:, ::-1], dyn, tile)
+            data = dyn
+        pipeline = preprocessing.dynamic_pipeline(dyn_normalize_frequency, dyn_normalize_time, outliers_sigma,
+                                                  block_size=rows * nx, chunked=True)
+        pipeline.run(data, out=dyn, profile=preprocessing_profile)
+        if report is not None:
+            report[:] = pipeline.report
+        dyn_mean = real_dtype()(sum(np.sum(dyn[start:start + rows], dtype=np.float64)
+                                    for start in range(0, ny, rows)) / (ny * nx))
+        dyn_t = temporary('dynamic_t.npy', real_dtype(), (nx, ny))
+        transpose_tiled(dyn, dyn_t, tile)
+        del dyn
+        discard('dynamic.npy')
+
+        # first pass: FFT along the frequency axis, on the rows of the transposed spectrum
+        transform_t = temporary('transform_t.npy', complex_dtype(), (nx, nh + 1))
+        for start in range(0, nx, cols):
+            chunk = np.array(dyn_t[start:start + cols])
+            chunk -= dyn_mean
+            transform_t[start:start + cols] = fft_along('rfft', chunk, 1)
+        del dyn_t
+        discard('dynamic_t.npy')
+        transform = temporary('transform.npy', complex_dtype(), (nh + 1, nx))
+        transpose_tiled(transform_t, transform, tile)
+        del transform_t
+        discard('transform_t.npy')
+        # second pass: FFT along the time axis, in place
+        for start in range(0, nh + 1, rows):
+            transform[start:start + rows] = fft_along('fft', transform[start:start + rows], 1)
+
+        def transform_chunks():
+            for start in range(0, nh + 1, rows):
+                yield start, np.array(transform[start:start + rows])
+
+        # non-values of the transform are replaced by its median (see repl_nonvals_wmed)
+        sec_median = None
+        if any(np.any((chunk == 0) | np.isnan(chunk)) for _, chunk in transform_chunks()):
+            sec_median = chunked_median(lambda: (chunk[~((chunk == 0) | np.isnan(chunk))].ravel()
+                                                 for _, chunk in transform_chunks()))
+        # the power, arranged like in half_plane_from_transform
+        half = np.lib.format.open_memmap(out_path, 'w+', real_dtype(), (nh, nx))
+        flip = (nx // 2 - np.arange(nx)) % nx
+        p_max = 0.
+        for start, chunk in transform_chunks():
+            if sec_median is not None:
+                np.copyto(chunk, sec_median, where=(chunk == 0) | np.isnan(chunk))
+            power = np.abs(chunk)**2
+            p_max = max(p_max, np.max(power))
+            if start == 0:  # the zero-delay row isn't kept
+                power = power[1:]
+                start = 1
+            half[nh - start - np.arange(len(power))] = power[:, flip]
+        del transform
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    for start in range(0, nh, rows):
+        chunk = half[start:start + rows]
+        np.divide(chunk, p_max, out=chunk)
+        np.log10(chunk, out=chunk)
+        chunk *= 10.  # in decibels
+    secondary = half_plane_postprocess(half, ny, subtract_secondary_background, normalize_frequency,
+                                       normalize_time, xscale, yscale, chunk_rows=rows)
+    half.flush()
+    return secondary
+
+
+def compute_secondaries(secondaries, keep_dynamic=False, **kwargs):
+    """
+    computes the secondary spectra of many observations together: observations with the same shape
+    are cleaned one by one into a 3D stack and Fourier transformed together, the post-processing is
+    done one by one again.
+    The results are the same as those of get_secondary_spectrum, which then returns them without
+    computing anything. Secondary spectra that are already computed or in secondary_cache are skipped.
+    :param secondaries: list of Secondary objects; all of their data is in memory at once
+    :param keep_dynamic: keep the dynamic spectra in the Secondary objects (otherwise they are
+           computed again if they are needed)
+    :param kwargs: parameters of get_secondary_spectrum
+    :return: secondaries
+    """
+    key = Secondary.secondary_key(**kwargs)
+    if not (key[3] and key[6]):  # the batched FFT is the one of the real-input half plane
+        for secondary in secondaries:
+            secondary.get_secondary_spectrum(**kwargs)
+        return secondaries
+    groups = OrderedDict()
+    for secondary in secondaries:
+        if not secondary.load_secondary(key):
+            shape = np.shape(secondary.raw_data)
+            groups.setdefault(shape[::-1] if secondary.rotate else shape, []).append(secondary)
+    dyn_key = Dynamic.get_dyn.__defaults__ + (precision,)
+    pipeline = preprocessing.dynamic_pipeline(*Dynamic.get_dyn.__defaults__)
+    for shape, group in groups.items():
+        stack = np.empty((len(group),) + shape, dtype=real_dtype())
+        for i, secondary in enumerate(group):  # the same preprocessing as get_dynamic_spectrum
+            pipeline.run(secondary.raw_data, secondary.rotate, profile=preprocessing_profile, out=stack[i])
+            secondary.preprocessing_report = pipeline.report
+        if keep_dynamic:
+            for i, secondary in enumerate(group):
+                secondary.dynamics[dyn_key] = stack[i]
+        transform = fft_along('rfft', stack - np.mean(stack, axis=(-2, -1), keepdims=True), 1)
+        if not keep_dynamic:
+            del stack
+        transform = fft_along('fft', transform, 2)
+        for i, secondary in enumerate(group):
+            secondary.store_secondary(key, half_plane_from_transform(transform[i], shape[0], *key[:3] + key[4:6]))
+        del transform
+    return secondaries
+
+
+def iter_secondaries(observations, batch_size=8, keep_dynamic=False, **kwargs):
+    """
+    makes Secondary objects, computing their secondary spectra batch_size at a time with
+    compute_secondaries, which bounds the memory needed.
+    :param observations: iterable of (data, db_header, filename, rotate) tuples (see Secondary),
+           e.g. made from the results of DB.extract
+    :param batch_size: number of observations whose data is processed together
+    :param keep_dynamic: see compute_secondaries
+    :param kwargs: parameters of get_secondary_spectrum
+    :return: generator of Secondary objects, in the order of the observations
+    """
+    batch = []
+    for data, db_header, filename, rotate in observations:
+        batch.append(Secondary(data, db_header, filename, rotate))
+        if len(batch) >= batch_size:
+            for secondary in compute_secondaries(batch, keep_dynamic, **kwargs):
+                yield secondary
+            batch = []
+    for secondary in compute_secondaries(batch, keep_dynamic, **kwargs):
+        yield secondary
+
+
+def secondary_stack(observations, **kwargs):
+    """
+    computes the secondary spectra of observations of the same shape and axes (see compute_secondaries)
+    :param observations: list of (data, db_header, filename, rotate) tuples (see Secondary)
+    :param kwargs: parameters of get_secondary_spectrum
+    :return: tuple of a numpy array (observations, y, x) and its (y_axis, x_axis)
+    """
+    secondaries = compute_secondaries([Secondary(*observation) for observation in observations], **kwargs)
+    axes = secondaries[0].get_sec_axes()
+    for secondary in secondaries[1:]:
+        if secondary.get_sec_axes() != axes:
+            raise ValueError('The axes of {0} differ from those of {1}'.format(secondary.filename,
+                                                                               secondaries[0].filename))
+    return np.stack([secondary.get_secondary_spectrum(**kwargs) for secondary in secondaries]), axes
+
+
+def scan_windowed_etas(stack, axes, etas, sigma=None):
+    """
+    computes the power along parabolas of the given curvatures (see crunchy_etas) in every window
+    of a windowed secondary spectrum (see Dynamic.get_windowed_secondary)
+    :param stack: numpy array (window, delay, fringe)
+    :param axes: (times, delay axis, fringe frequency axis)
+    :param etas: list of curvatures
+    :param sigma: [y, x] widths of the weighting, defaults to one pixel
+    :return: numpy array (window, eta) of the powers
+    """
+    powers = np.empty((len(stack), len(etas)))
+    for i in range(len(stack)):
+        view = SecondaryView(stack[i], axes[1], axes[2])
+        powers[i] = [power for _, power in crunchy_etas(etas, view, sigma=sigma)]
+    return powers
 
 
 def distparab(x, y, a):  # Calculate distance away from parabola
-    x = -abs(x)
-    A = 1.0/(2.0*a*a) - y/a
-    B = -x/(2.0*a*a)
-    xp, _r2, _r3 = np.roots([1.0, 0.0, A, B])  # problem can be reduced to solving this equation: x^3+Ax+B=0
-    yp = a*pow(xp, 2)
+    x = -np.abs(x)
+    xp = closest_point_on_the_parabola(a, x, y)  # works on arrays of points as well
+    yp = a*xp**2
     dx = xp - x
     dy = yp - y
     return dx, dy
 
 
 class Parabola:
-    def __init__(self, secondary, xrange, yrange, mask, max_t):
+    def __init__(self, secondary, xrange, yrange, mask, max_t, etas):
         """
+        Index of the pixels that belong to the parabolas y = eta * x^2 of a secondary spectrum.
+        For every eta it holds the pixels within max_t pixels of the parabola and their weights,
+        so the mean power along all the parabolas is a single sparse matrix-vector product
+        (see power()). Only the axes of the secondary are used, the index can be reused for
+        every secondary spectrum with the same axes (see get_parabola).
         :param secondary: a secondary object
         :param xrange: range of x-values to consider (x_min, x_max) [mHz]
         :param yrange: range of y-values to consider (y_min, y_max) [us]
         :param mask: data points <= than this many pixels from origin/x-axis/y-axis will be masked
         :param max_t: max parabola thickness
+        :param etas: list of parabola curvatures
         """
         functions.check_object_type(secondary, Secondary)
 
-        self.sec = secondary
-        self.sec_axes = self.sec.get_axes()
-        self.sec_arr = self.sec.get_data()
-        self.y_orig, self.x_orig = np.shape(self.sec_arr)  # get dimensions from the secondary array
+        self.sec_axes = (np.asarray(secondary.get_y_axis(), dtype=float),
+                         np.asarray(secondary.get_x_axis(), dtype=float))
+        self.y_orig, self.x_orig = len(self.sec_axes[0]), len(self.sec_axes[1])  # dimensions of the secondary
         self.dy = abs(self.sec_axes[0][1]-self.sec_axes[0][0])  # sec_axes[0] is the delay/y-axis
-        self.dx = abs(self.sec_axes[1][0][1]-self.sec_axes[1][0][0])
+        self.dx = abs(self.sec_axes[1][1]-self.sec_axes[1][0])
         # If specified x and y limits are outside of actual data, trim them to fit actual data
         self.min_x = xrange[0] if xrange[0] >= min(self.sec_axes[1]) else min(self.sec_axes[1])
         self.max_x = xrange[1] if xrange[1] <= max(self.sec_axes[1]) else max(self.sec_axes[1])
@@ -522,4 +1372,116 @@ class Parabola:
         self.mask_x = np.floor(self.mask_x) + 0.5
         self.mask_y = np.floor(self.mask_y) + 0.5
 
-        is_dB = True  # indicates power values are log (dB) values
+        self.is_dB = True  # indicates power values are log (dB) values
+        self.etas = list(etas)
+        self.make_index()
+
+    def get_pixels(self):
+        """
+        finds the pixels inside xrange/yrange that are not masked
+        :return: flat indices of those pixels into the secondary array
+        """
+        y, x = np.meshgrid(self.sec_axes[0], self.sec_axes[1], indexing='ij')
+        keep = (x >= self.min_x) & (x <= self.max_x) & (y >= self.min_y) & (y <= self.max_y)
+        if self.mask_o > 0:
+            keep &= (x / self.mask_ox) ** 2 + (y / self.mask_oy) ** 2 > 1.
+        keep &= np.abs(y) > self.mask_x * self.dy  # close to the x-axis
+        keep &= np.abs(x) > self.mask_y * self.dx  # close to the y-axis
+        return np.flatnonzero(keep)
+
+    def make_index(self, max_elements=2 ** 22):
+        """
+        builds the sparse (eta, pixel) -> weight index. A pixel belongs to a parabola if its
+        distance to the closest point of the parabola is at most max_t pixels; its weight is
+        a Gaussian of that distance, with max_t at 3 sigma.
+        :param max_elements: limits the size of the (etas, pixels) blocks evaluated at once
+        """
+        pixels = self.get_pixels()
+        py = self.sec_axes[0][pixels // self.x_orig]
+        px = self.sec_axes[1][pixels % self.x_orig]
+
+        rows, cols, weights = [], [], []
+        chunk_size = max(1, max_elements // max(len(pixels), 1))
+        for start in range(0, len(self.etas), chunk_size):
+            eta = np.asarray(self.etas[start:start + chunk_size], dtype=float)[:, np.newaxis]
+            x = closest_point_on_the_parabola(eta, px, py)
+            dist = np.hypot((px - x) / self.dx, (py - eta * x ** 2) / self.dy)  # in pixels
+            eta_index, pixel_index = np.nonzero(dist <= self.max_t)
+            rows.append(eta_index + start)
+            cols.append(pixels[pixel_index])
+            weights.append(gaussian(dist[eta_index, pixel_index], 0., self.max_t / 3.))
+        self.rows = np.concatenate(rows) if rows else np.empty(0, dtype=int)
+        self.cols = np.concatenate(cols) if cols else np.empty(0, dtype=int)
+        self.weights = np.concatenate(weights) if weights else np.empty(0)
+        self.norm = np.bincount(self.rows, self.weights, minlength=len(self.etas))  # sum of the weights without NaNs
+
+    def power(self, data):
+        """
+        computes the weighted mean power along every parabola of the index
+        :param data: secondary spectrum (2D array with the axes of this index)
+        :return: numpy array with one power value per eta
+        """
+        values = np.asarray(data).ravel()[self.cols]
+        valid = ~np.isnan(values)
+        if valid.all():
+            norm = self.norm
+        else:  # NaN pixels count neither in the power nor in the weights
+            norm = np.bincount(self.rows[valid], self.weights[valid], minlength=len(self.etas))
+        power = np.bincount(self.rows[valid], self.weights[valid] * values[valid], minlength=len(self.etas))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return power / norm
+
+
+_parabolas = OrderedDict()  # cache of Parabola indices, see get_parabola
+parabola_cache_size = 8
+
+
+def get_parabola(secondary, etas, xrange, yrange, mask, max_t):
+    """
+    returns the Parabola index for the axes of a secondary spectrum. Indices are cached,
+    so secondary spectra with identical axes share one index.
+    :param secondary: a secondary object
+    :return: Parabola object
+    """
+    key = (np.asarray(secondary.get_y_axis(), dtype=float).tobytes(),
+           np.asarray(secondary.get_x_axis(), dtype=float).tobytes(),
+           tuple(etas), tuple(xrange), tuple(yrange), tuple(mask), max_t)
+    if key in _parabolas:
+        _parabolas.move_to_end(key)
+    else:
+        _parabolas[key] = Parabola(secondary, xrange, yrange, mask, max_t, etas)
+        while len(_parabolas) > parabola_cache_size:
+            _parabolas.popitem(last=False)
+    return _parabolas[key]
+
+
+def precision_check(data, db_header, etas, filename=None, rotate=False, db_tol=0.5, eta_tol=1e-2):
+    """
+    computes the secondary spectrum and the curvature of the strongest arc (the maximum of
+    make_1D_by_quadratic over etas) in single and in double precision and compares them.
+    The data itself is not changed.
+    :param data: HDUList, as for Secondary
+    :param db_header: as for Secondary
+    :param etas: list of curvatures to compare
+    :param db_tol: tolerated difference of the secondary spectra in dB
+    :param eta_tol: tolerated relative difference of the curvatures
+    :return: dict with the maximum difference in dB ('db_error'), the curvatures ('eta_single',
+             'eta_double'), their relative difference ('eta_error') and whether both are within tolerance ('ok')
+    """
+    functions.check_object_type(data, fits.HDUList)
+    previous = precision
+    results = {}
+    try:
+        for name in ['single', 'double']:
+            set_precision(name)
+            hdulist = fits.HDUList([fits.PrimaryHDU(data=np.array(data[0].data), header=data[0].header)])
+            sec = Secondary(hdulist, db_header, filename, rotate)
+            etas_, powers = sec.make_1D_by_quadratic(etas)
+            results[name] = (sec.get_sec(), etas_[int(np.nanargmax(powers))])
+    finally:
+        set_precision(previous)
+    db_error = float(np.nanmax(np.abs(results['single'][0] - results['double'][0])))
+    eta_single, eta_double = results['single'][1], results['double'][1]
+    eta_error = abs(eta_single - eta_double) / abs(eta_double) if eta_double else abs(eta_single)
+    return {'db_error': db_error, 'eta_single': eta_single, 'eta_double': eta_double, 'eta_error': eta_error,
+            'ok': db_error <= db_tol and eta_error <= eta_tol}
@@ -1,6 +1,9 @@
 # these are all helper functions to help with multiprocessing on the
 # automatic arc curvature detections.
 
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
 import numpy as np
 
 
@@ -9,46 +12,104 @@ def gaussian(x, mu, sig):
     return np.exp(-(x - mu) ** 2 / (2. * sig ** 2))
 
 
-# user specifies a parabola starting at the origin with formula y=ax**2 , 
+# returns the spacing of an evenly spaced axis (like one made with np.linspace), or
+# None if the axis is not evenly spaced.
+def axis_step(axis):
+    axis = np.asarray(axis, dtype=float)
+    if len(axis) < 2:
+        return None
+    step = (axis[-1] - axis[0]) / (len(axis) - 1.)
+    if step != 0. and np.allclose(np.diff(axis), step, rtol=1e-6, atol=0.):
+        return step
+    return None
+
+
+def nearest_index(axis, value, step=None):
+    """
+    finds the index of the axis sample closest to value. For evenly spaced axes (give their
+    step, see axis_step) this is a direct computation, for other monotonic axes a binary
+    search, and otherwise a search through the whole axis.
+    :param axis: numpy array
+    :param value: a number or an array of numbers
+    :param step: spacing of the axis if it is evenly spaced
+    :return: index (int) or numpy array of indices with the shape of value
+    """
+    axis = np.asarray(axis, dtype=float)
+    value = np.asarray(value, dtype=float)
+    # on a tie the lower index wins
+    if step is not None:
+        index = np.clip(np.ceil((value - axis[0]) / step - 0.5), 0, len(axis) - 1).astype(int)
+    elif len(axis) > 1 and (np.all(np.diff(axis) > 0) or np.all(np.diff(axis) < 0)):
+        if axis[0] < axis[-1]:
+            index = np.clip(np.searchsorted(axis, value), 1, len(axis) - 1)
+            index = np.where(value - axis[index - 1] <= axis[index] - value, index - 1, index)
+        else:
+            ascending = axis[::-1]
+            index = np.clip(np.searchsorted(ascending, value), 1, len(axis) - 1)
+            index = np.where(value - ascending[index - 1] < ascending[index] - value, index - 1, index)
+            index = len(axis) - 1 - index
+    else:
+        index = np.argmin(np.absolute(axis - value[..., np.newaxis]), axis=-1)
+    return index[()]
+
+
+# user specifies a parabola starting at the origin with formula y=ax**2 ,
 # and also a point with x=px and y=py, and this function returns
 # the x-coordinate of the closest point on the parabola.
+# a, px and py may be arrays, they are broadcast against each other. The closest
+# point is a root of 2a^2 x^3 + (1 - 2a py) x - px = 0; this cubic is solved in
+# closed form, with Cardano's formula where it has one real root and with the
+# trigonometric method where it has three (then the nearest of them is taken).
 def closest_point_on_the_parabola(a, px, py):
-    thingy1 = 2. * a * py
-    thingy2 = np.sqrt(-3 + 0j)
-    thingy3 = 2 ** (1 / 3.)
-    thingy4 = 2 ** (2 / 3.)
-    thingy = (-108. * a ** 4 * px + np.sqrt(11664. * a ** 8 * px ** 2 - 864. * a ** 6 * (-1 + thingy1) ** 3 + 0j)) ** (
-    1 / 3.)
-    Aone = (thingy3 * (-1. + thingy1))
-    Atwo = thingy
-    Athree = thingy
-    Afour = (6. * thingy3 * a ** 2)
-    Bone = ((1. + thingy2) * (-1. + thingy1))
-    Btwo = (thingy4 * thingy)
-    Bthree = ((1. - thingy2) * thingy)
-    Bfour = (12. * thingy3 * a ** 2)
-    Cone = (1. - thingy2) * (-1 + thingy1)
-    Ctwo = thingy4 * thingy
-    Cthree = (1. + thingy2) * thingy
-    Cfour = 12. * thingy3 * a ** 2
-
-    A = -np.real(Aone / Atwo + Athree / Afour)
-    B = np.real(Bone / Btwo + Bthree / Bfour)
-    C = np.real(Cone / Ctwo + Cthree / Cfour)
-
-    solns = [A, B, C]
-    solns_temp = []
-    for soln in solns:
-        solns_temp.append(np.abs(soln - px))
-
-    val, idx = min((val, idx) for (idx, val) in enumerate(solns_temp))
-    return solns[idx]
+    a, px, py = np.broadcast_arrays(np.asarray(a, dtype=float), np.asarray(px, dtype=float),
+                                    np.asarray(py, dtype=float))
+    c3 = 2. * a ** 2
+    c1 = 1. - 2. * a * py
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        # for a -> 0 the parabola becomes the x-axis and the cubic becomes linear
+        x_lin = np.where(c1 != 0., px / c1, px)
+        scale = np.maximum(np.hypot(px, py), np.abs(x_lin))
+        linear = c3 * scale ** 2 <= 1e-12 * np.abs(c1)
+
+        # depressed cubic x^3 + p x + q = 0
+        p = c1 / c3
+        q = -px / c3
+        disc = (q / 2.) ** 2 + (p / 3.) ** 3
+
+        # one real root; u^3 is chosen on the side that avoids cancellation
+        w = -q / 2.
+        u = np.cbrt(w + np.where(w >= 0., 1., -1.) * np.sqrt(np.maximum(disc, 0.)))
+        x = np.where(u != 0., u - p / (3. * u), 0.)
+
+        # three real roots (disc < 0 implies p < 0)
+        r = np.sqrt(np.maximum(-p / 3., 0.))
+        theta = np.arccos(np.clip(np.where(r > 0., w / r ** 3, 0.), -1., 1.)) / 3.
+        three = disc < 0.
+        if np.any(three):
+            best_x = x
+            best_d = np.full(x.shape, np.inf)
+            for k in range(3):
+                xk = 2. * r * np.cos(theta - 2. * np.pi * k / 3.)
+                dk = (xk - px) ** 2 + (a * xk ** 2 - py) ** 2
+                closer = three & (dk < best_d)
+                best_x = np.where(closer, xk, best_x)
+                best_d = np.where(closer, dk, best_d)
+            x = best_x
+
+        x = np.where(linear | ~np.isfinite(x), x_lin, x)
+
+        # one Newton step on the full cubic to clean up rounding errors, kept only where it helps
+        f = c3 * x ** 3 + c1 * x - px
+        x_new = x - f / (3. * c3 * x ** 2 + c1)
+        f_new = c3 * x_new ** 3 + c1 * x_new - px
+        x = np.where(np.isfinite(x_new) & (np.abs(f_new) < np.abs(f)), x_new, x)
+    return x[()]
 
 
 # returns how far the specified point is from the closest point on the parabola.
 def dist_from_parabola(a, px, py):
     X = closest_point_on_the_parabola(a, px, py)
-    return X, np.sqrt(a ** 2 * X ** 4 - 2. * a * X ** 2 * py + py ** 2 + X ** 2 - 2. * px * X + px ** 2)
+    return X, np.hypot(px - X, py - a * X ** 2)
 
 
 def weight_function(eta, px, py, sigma=[1, 1]):
@@ -63,6 +124,27 @@ def weight_function(eta, px, py, sigma=[1, 1]):
     return ret
 
 
+# returns the x and y distances of points from their closest points on the parabola y=ax**2.
+# Like closest_point_on_the_parabola, this works on (broadcastable) arrays.
+def parabola_residuals(a, px, py):
+    x = closest_point_on_the_parabola(a, px, py)
+    return px - x, py - a * x ** 2
+
+
+# the weights of weight_function/weight_function3 computed from the distances to the
+# parabola; points below the cut-off get a weight of 0 instead of None.
+def residual_weights(dist_from_origin, res_x, res_y, sigma):
+    ret = dist_from_origin * np.sqrt(gaussian(res_x, 0, sigma[1]) * gaussian(res_y, 0, sigma[0]))
+    return np.where(ret < (1 / np.e ** 3), 0., ret)
+
+
+# array version of weight_function: eta, px and py may be arrays that broadcast
+# against each other. Points below the cut-off get a weight of 0 instead of None.
+def arc_weights(eta, px, py, sigma=(1, 1)):
+    res_x, res_y = parabola_residuals(eta, px, py)
+    return residual_weights(np.sqrt(px ** 2 + py ** 2), res_x, res_y, sigma)
+
+
 def weight_function2(y, x, py, px, sigma):
     ret_y = gaussian(py - y, 0, sigma[0])
     ret_x = gaussian(px - x, 0, sigma[1])
@@ -85,102 +167,372 @@ def weight_function3(eta, orig_y, orig_x, py, px, sigma):
 
 
 def crunchy(eta, sec, hand=None, sigma=None):
-    powers = []
-    powers_norm = []
+    return crunchy_etas([eta], sec, hand, sigma)[0]
 
-    y_axis = sec.get_y_axis()
-    x_axis = sec.get_x_axis()
+
+def arc_band(eta, y_axis, x_axis, sigma, d_max=None):
+    """
+    finds the pixels that can get a non-zero weight from arc_weights, column by column.
+    The weight is at most max(dist_from_origin) * exp(-res_x^2/(4 sigma_x^2) - res_y^2/(4 sigma_y^2)),
+    and it is cut off below 1/e^3, so the distances res_x, res_y to the closest point of the
+    parabola are bounded. For every column that bounds the x of the closest point, hence the
+    y range of the pixels, which is then looked up in the y axis.
+    :param eta: curvature
+    :param y_axis: monotonic y axis (numpy array)
+    :param x_axis: x axis (numpy array)
+    :param sigma: [y, x] widths of the weighting
+    :param d_max: bound of the distance from the origin in the weights, defaults to the one of the axes
+    :return: row and column indices of the pixels in the band
+    """
+    if d_max is None:
+        d_max = np.sqrt(np.max(x_axis ** 2) + np.max(y_axis ** 2))
+    q = 3. + np.log(d_max) if d_max > 0. else -1.  # bound of res_x^2/(4 sigma_x^2) + res_y^2/(4 sigma_y^2)
+    if not q >= 0.:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+    reach_y = 2. * np.absolute(sigma[0]) * np.sqrt(q) * (1. + 1e-9)  # a little slack for rounding
+    reach_x = 2. * np.absolute(sigma[1]) * np.sqrt(q) * (1. + 1e-9)
+
+    # range of eta*x^2 for x within reach_x of the column
+    lo_x = x_axis - reach_x
+    hi_x = x_axis + reach_x
+    ends = eta * np.array([lo_x ** 2, hi_x ** 2])
+    apex = np.where((lo_x <= 0.) & (hi_x >= 0.), 0., ends[0])
+    y_lo = np.minimum(ends.min(axis=0), apex) - reach_y
+    y_hi = np.maximum(ends.max(axis=0), apex) + reach_y
+
+    descending = y_axis[0] > y_axis[-1]
+    y_sorted = y_axis[::-1] if descending else y_axis
+    start = np.searchsorted(y_sorted, y_lo, 'left')
+    stop = np.searchsorted(y_sorted, y_hi, 'right')
+    if descending:
+        start, stop = len(y_axis) - stop, len(y_axis) - start
+
+    counts = stop - start
+    cols = np.repeat(np.arange(len(x_axis)), counts)
+    rows = np.repeat(start - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+    return rows, cols
+
+
+# evaluates crunchy for a whole list of etas. By default only the pixels in the band
+# around each parabola are visited (see arc_band), so the cost scales with the length
+# of the arc instead of the size of the image. With band=False (or axes that are not
+# monotonic) the weights of several etas are computed together on the full pixel grid;
+# max_elements limits the size of these (n_etas, y, x) blocks.
+def crunchy_etas(etas, sec, hand=None, sigma=None, band=True, max_elements=2 ** 22):
+    y_axis = np.asarray(sec.get_y_axis(), dtype=float)
+    x_axis = np.asarray(sec.get_x_axis(), dtype=float)
     if sigma is None:
         sigma = [np.absolute(y_axis[1] - y_axis[0]),
                  np.absolute(x_axis[1] - x_axis[0])]
 
-    for yi in range(len(y_axis)):
-        y = y_axis[yi]
-        for xi in range(len(x_axis)):
-            x = x_axis[xi]
-            this_weight = weight_function(eta, x, y, sigma)
-            if this_weight is None:
-                powers.append(None)
-                powers_norm.append(None)
-            else:
-                variance = 1 / this_weight
-                powers.append(sec.get([yi, xi]) / variance)
-                powers_norm.append(1 / variance)
-    p = np.nansum(list(filter(None, powers)))
-    pn = np.nansum(list(filter(None, powers_norm)))
-    # print("eta: " + str(eta))
-    # print(p)
-    # print(pn)
-    # print("p/pn: " + str(p/pn))
-    return eta, p / pn
-
+    data = sec.get_sec()
+    steps = np.diff(y_axis)
+    results = []
+    if band and (np.all(steps > 0) or np.all(steps < 0)):
+        for eta in etas:
+            rows, cols = arc_band(eta, y_axis, x_axis, sigma)
+            weights = arc_weights(eta, x_axis[cols], y_axis[rows], sigma)
+            p = np.nansum(weights * data[rows, cols])
+            pn = np.nansum(weights)
+            results.append((eta, p / pn))
+        return results
 
-def crunchy2(pt_and_sigma, sec, hand=None):
-    pt, sigma = pt_and_sigma
-    py, px = pt
+    py = y_axis[:, np.newaxis]
+    px = x_axis[np.newaxis, :]
+    chunk_size = max(1, max_elements // data.size)
+    for start in range(0, len(etas), chunk_size):
+        chunk = list(etas[start:start + chunk_size])
+        eta = np.asarray(chunk, dtype=float)[:, np.newaxis, np.newaxis]
+        weights = arc_weights(eta, px, py, sigma)
+        p = np.nansum(weights * data, axis=(1, 2))
+        pn = np.nansum(weights, axis=(1, 2))
+        results.extend(zip(chunk, p / pn))
+    return results
 
-    powers = []
-    powers_norm = []
 
-    y_axis = sec.get_y_axis()
-    x_axis = sec.get_x_axis()
+# sigma of crunchy2/crunchy3: one pixel by default, and never smaller than a pixel.
+def point_sigma(sigma, y_axis, x_axis):
     px_y = np.absolute(y_axis[1] - y_axis[0])
     px_x = np.absolute(x_axis[1] - x_axis[0])
-
-    if sigma == None:
+    if sigma is None:
         sigma = [px_y, px_x]
-    if sigma[0] < px_y:
-        sigma = [px_y, sigma[1]]
-    if sigma[1] < px_x:
-        sigma = [sigma[0], px_x]
-
-    for yi in range(len(y_axis)):
-        y = y_axis[yi]
-        for xi in range(len(x_axis)):
-            x = x_axis[xi]
-            this_weight = weight_function2(y, x, py, px, sigma)
-            if this_weight is None:
-                powers.append(None)
-                powers_norm.append(None)
-            else:
-                variance = 1 / this_weight
-                powers.append(sec.get([yi, xi]) / variance)
-                powers_norm.append(1 / variance)
-    p = np.nansum(list(filter(None, powers)))
-    pn = np.nansum(list(filter(None, powers_norm)))
-    return pt, p / pn
+    return [max(sigma[0], px_y), max(sigma[1], px_x)]
 
 
-def crunchy3(offset, eta, sec, sigma=None):
-    powers = []
-    powers_norm = []
+def point_kernel(sigma, y_axis, x_axis):
+    """
+    the weights of weight_function2 on the pixel grid, as a 2D kernel centred on a point
+    :param sigma: [y, x] widths, as returned by point_sigma
+    :return: 2D numpy array of odd size; weights below the cut-off are 0
+    """
+    d_y = np.absolute(y_axis[1] - y_axis[0])
+    d_x = np.absolute(x_axis[1] - x_axis[0])
+    # weight_function2 is exp(-dy^2/(4 sigma_y^2) - dx^2/(4 sigma_x^2)) and is cut off at 1/e^3
+    r_y = int(np.floor(np.sqrt(12.) * sigma[0] / d_y))
+    r_x = int(np.floor(np.sqrt(12.) * sigma[1] / d_x))
+    dy = np.arange(-r_y, r_y + 1)[:, np.newaxis] * d_y
+    dx = np.arange(-r_x, r_x + 1)[np.newaxis, :] * d_x
+    kernel = np.sqrt(gaussian(dy, 0, sigma[0]) * gaussian(dx, 0, sigma[1]))
+    kernel[kernel < (1 / np.e ** 3)] = 0.
+    return kernel
+
 
+def power_maps(data, y_axis, x_axis, sigmas):
+    """
+    computes the crunchy2 power (weighted mean around a point) for every pixel of the
+    secondary spectrum at once, by convolving with the weight kernel via FFTs. The
+    spectrum is transformed once for all sigmas.
+    :param data: secondary spectrum
+    :param sigmas: list of sigmas (see crunchy2)
+    :return: numpy array (len(sigmas), y, x)
+    """
+    data = np.asarray(data, dtype=float)
+    nan = np.isnan(data)
+    kernels = [point_kernel(point_sigma(sigma, y_axis, x_axis), y_axis, x_axis) for sigma in sigmas]
+    r_y = max(k.shape[0] for k in kernels) // 2
+    r_x = max(k.shape[1] for k in kernels) // 2
+    shape = (data.shape[0] + 2 * r_y, data.shape[1] + 2 * r_x)  # no wrap-around
+    data_ft = np.fft.rfft2(np.where(nan, 0., data), shape)
+    ones_ft = np.fft.rfft2(np.ones(data.shape), shape)  # NaN pixels still count in the weights
+
+    maps = np.empty((len(sigmas),) + data.shape)
+    for i, kernel in enumerate(kernels):
+        kernel_ft = np.fft.rfft2(kernel, shape)
+        k_y, k_x = kernel.shape[0] // 2, kernel.shape[1] // 2
+        window = (slice(k_y, k_y + data.shape[0]), slice(k_x, k_x + data.shape[1]))
+        p = np.fft.irfft2(data_ft * kernel_ft, shape)[window]
+        pn = np.fft.irfft2(ones_ft * kernel_ft, shape)[window]
+        maps[i] = p / pn
+    return maps
+
+
+def get_power_map(sec, sigma=None):
+    """
+    the power map of power_maps for a single sigma. It is cached in sec.power_maps, if sec has one.
+    :param sec: a Secondary (or SecondaryView) object
+    :param sigma: [y, x] widths, see crunchy2
+    :return: 2D numpy array
+    """
     y_axis = sec.get_y_axis()
     x_axis = sec.get_x_axis()
-    px_y = np.absolute(y_axis[1] - y_axis[0])
-    px_x = np.absolute(x_axis[1] - x_axis[0])
+    sigma = tuple(point_sigma(sigma, y_axis, x_axis))
+    cache = getattr(sec, 'power_maps', None)
+    if cache is not None and sigma in cache:
+        return cache[sigma]
+    power_map = power_maps(sec.get_sec(), y_axis, x_axis, [sigma])[0]
+    if cache is not None:
+        cache[sigma] = power_map
+    return power_map
 
-    if sigma is None:
-        sigma = [px_y, px_x]
-    if sigma[0] < px_y:
-        sigma = [px_y, sigma[1]]
-    if sigma[1] < px_x:
-        sigma = [sigma[0], px_x]
-
-    for yi in range(len(y_axis)):
-        y = y_axis[yi]
-        for xi in range(len(x_axis)):
-            x = x_axis[xi]
-            y_eff = y + eta * offset ** 2
-            x_eff = x - offset
-            this_weight = weight_function3(eta, y, x, y_eff, x_eff, sigma)
-            if this_weight is None:
-                powers.append(None)
-                powers_norm.append(None)
-            else:
-                variance = 1 / this_weight
-                powers.append(sec.get([yi, xi]) / variance)
-                powers_norm.append(1 / variance)
-    p = np.nansum(list(filter(None, powers)))
-    pn = np.nansum(list(filter(None, powers_norm)))
+
+# the weighted mean power around a point, looked up in the power map of the secondary
+# (the point is rounded to the nearest pixel).
+def crunchy2(pt_and_sigma, sec, hand=None):
+    pt, sigma = pt_and_sigma
+    py, px = pt
+
+    power_map = get_power_map(sec, sigma)
+    yi = nearest_index(sec.get_y_axis(), py)
+    xi = nearest_index(sec.get_x_axis(), px)
+    return pt, power_map[yi, xi]
+
+
+def crunchy3(offset, eta, sec, sigma=None):
+    y_axis = np.asarray(sec.get_y_axis(), dtype=float)
+    x_axis = np.asarray(sec.get_x_axis(), dtype=float)
+    sigma = point_sigma(sigma, y_axis, x_axis)
+
+    py = y_axis[:, np.newaxis]
+    px = x_axis[np.newaxis, :]
+    res_x, res_y = parabola_residuals(eta, px - offset, py + eta * offset ** 2)
+    weights = residual_weights(np.sqrt(px ** 2 + py ** 2), res_x, res_y, sigma)
+    p = np.nansum(weights * sec.get_sec())
+    pn = np.nansum(weights)
     return offset, p / pn
+
+
+def crunchy3_grid(offsets, etas, sec, sigma=None, band=True):
+    """
+    computes crunchy3 for every combination of offsets and etas.
+    A shifted parabola is the parabola of the same eta evaluated at shifted coordinates
+    (x - offset, y + eta * offset^2), so arc_band finds the pixels around it on the shifted
+    axes. By default only these pixels are evaluated, which gives the results of crunchy3
+    (up to round-off) at a fraction of the cost.
+    :param offsets: list of x-offsets of the parabola apex
+    :param etas: list of curvatures
+    :param sec: a Secondary (or SecondaryView) object
+    :param sigma: [y, x] widths of the weighting, defaults to (and at least) one pixel
+    :param band: if False, every pixel is evaluated for every combination (like crunchy3).
+           This is also done if the y axis is not monotonic.
+    :return: numpy array (len(offsets), len(etas)) of powers
+    """
+    y_axis = np.asarray(sec.get_y_axis(), dtype=float)
+    x_axis = np.asarray(sec.get_x_axis(), dtype=float)
+    sigma = point_sigma(sigma, y_axis, x_axis)
+    data = sec.get_sec()
+    plane = np.empty((len(offsets), len(etas)))
+
+    steps = np.diff(y_axis)
+    if not band or not (np.all(steps > 0) or np.all(steps < 0)):
+        for i, offset in enumerate(offsets):
+            for j, eta in enumerate(etas):
+                plane[i, j] = crunchy3(offset, eta, sec, sigma)[1]
+        return plane
+
+    d_max = np.sqrt(np.max(x_axis ** 2) + np.max(y_axis ** 2))  # the weights grow with the unshifted distance
+    for i, offset in enumerate(offsets):
+        for j, eta in enumerate(etas):
+            rows, cols = arc_band(eta, y_axis + eta * offset ** 2, x_axis - offset, sigma, d_max)
+            py = y_axis[rows]
+            px = x_axis[cols]
+            res_x, res_y = parabola_residuals(eta, px - offset, py + eta * offset ** 2)
+            weights = residual_weights(np.sqrt(px ** 2 + py ** 2), res_x, res_y, sigma)
+            plane[i, j] = np.nansum(weights * data[rows, cols]) / np.nansum(weights)
+    return plane
+
+
+def search_eta(sec, eta_range, num_coarse=25, num_peaks=3, tol=1e-3, sigma=None):
+    """
+    finds the curvature with the most power (see crunchy) without scanning a dense grid:
+    first a coarse grid evenly spaced in 1/sqrt(eta) is scanned, then each of the highest
+    local maxima is refined with a golden-section search between its grid neighbours,
+    until the bracket is narrower than tol (relative to eta).
+    :param sec: a Secondary (or SecondaryView) object
+    :param eta_range: (eta_min, eta_max)
+    :param num_coarse: number of etas in the coarse grid
+    :param num_peaks: number of local maxima of the coarse scan that are refined
+    :param tol: relative precision of the returned eta
+    :param sigma: [y, x] widths of the weighting, defaults to one pixel
+    :return: tuple of the best eta, its power, the number of crunchy evaluations and
+             a list of all evaluated (eta, power) pairs, sorted by eta
+    """
+    powers = {}
+
+    def power(u):  # u = 1/sqrt(eta)
+        eta = 1. / u ** 2
+        if eta not in powers:
+            powers[eta] = crunchy(eta, sec, sigma=sigma)[1]
+        return powers[eta]
+
+    u_grid = np.linspace(np.sqrt(1. / max(eta_range)), np.sqrt(1. / min(eta_range)), num_coarse)
+    for eta, p in crunchy_etas(list(1. / u_grid ** 2), sec, sigma=sigma):
+        powers[eta] = p
+    coarse = np.array([powers[1. / u ** 2] for u in u_grid])
+    coarse = np.where(np.isnan(coarse), -np.inf, coarse)
+
+    # local maxima of the coarse scan (the ends count if they are higher than their neighbour)
+    padded = np.concatenate(([-np.inf], coarse, [-np.inf]))
+    peaks = np.flatnonzero((coarse >= padded[:-2]) & (coarse >= padded[2:]) & np.isfinite(coarse))
+    peaks = peaks[np.argsort(coarse[peaks])[::-1][:num_peaks]]
+
+    invphi = (np.sqrt(5.) - 1.) / 2.
+    for i in peaks:
+        lo = u_grid[max(i - 1, 0)]
+        hi = u_grid[min(i + 1, len(u_grid) - 1)]
+        c = hi - invphi * (hi - lo)
+        d = lo + invphi * (hi - lo)
+        # eta = 1/u^2, so a relative width of tol in eta is about tol/2 in u
+        while hi - lo > tol / 2. * (hi + lo) / 2.:
+            if power(c) >= power(d):
+                hi, d = d, c
+                c = hi - invphi * (hi - lo)
+            else:
+                lo, c = c, d
+                d = lo + invphi * (hi - lo)
+
+    evaluated = sorted(powers.items())
+    best_eta, best_power = max(evaluated, key=lambda ep: -np.inf if np.isnan(ep[1]) else ep[1])
+    return best_eta, best_power, len(evaluated), evaluated
+
+
+# a light stand-in for a Secondary object. It only holds the secondary spectrum
+# and its axes, which is all the crunchy functions need, so worker processes can
+# build one around a shared memory block instead of receiving a pickled Secondary.
+class SecondaryView:
+    def __init__(self, data, y_axis, x_axis):
+        self.data = data
+        self.y_axis = y_axis
+        self.x_axis = x_axis
+        self.power_maps = {}
+
+    def get(self, value):
+        return self.data.item(tuple(value))
+
+    def get_y_axis(self):
+        return self.y_axis
+
+    def get_x_axis(self):
+        return self.x_axis
+
+    def get_sec(self):
+        return self.data
+
+
+_shared_sec = None  # the SecondaryView of a worker process, set up by _init_shared_worker
+_shared_block = None
+
+
+def _init_shared_worker(name, shape, dtype, y_axis, x_axis):
+    global _shared_sec, _shared_block
+    _shared_block = shared_memory.SharedMemory(name=name)
+    data = np.ndarray(shape, dtype=dtype, buffer=_shared_block.buf)
+    _shared_sec = SecondaryView(data, y_axis, x_axis)
+
+
+def _crunch_task(task):
+    kind, values, kwargs = task
+    return _crunch(kind, values, _shared_sec, kwargs)
+
+
+def _crunch(kind, values, sec, kwargs):
+    if kind == 'eta':
+        return crunchy_etas(values, sec, sigma=kwargs.get('sigma'))
+    elif kind == 'offset':
+        return [crunchy3(offset, kwargs['eta'], sec, kwargs.get('sigma')) for offset in values]
+    elif kind == 'point':
+        return [crunchy2(pt_and_sigma, sec) for pt_and_sigma in values]
+    else:
+        raise ValueError('unknown scan type: {0}'.format(kind))
+
+
+def parallel_crunch(kind, values, sec, processes=None, chunksize=None, **kwargs):
+    """
+    runs crunchy ('eta'), crunchy3 ('offset') or crunchy2 ('point') for every element of values
+    in a pool of worker processes. The secondary spectrum is copied once into a shared memory
+    block, which the workers read from instead of each getting a pickled copy.
+    :param kind: 'eta', 'offset' or 'point'
+    :param values: list of etas, offsets or (point, sigma) tuples
+    :param sec: a Secondary (or SecondaryView) object
+    :param processes: number of worker processes, defaults to the number of CPUs
+    :param chunksize: number of values handed to a worker at once
+    :param kwargs: sigma for 'eta' and 'offset', and eta for 'offset'
+    :return: list of the crunchy results, in the same order as values
+    """
+    values = list(values)
+    if processes is None:
+        processes = mp.cpu_count()
+    if chunksize is None:
+        chunksize = max(1, -(-len(values) // (4 * processes)))  # about four chunks per worker
+    if processes == 1 or len(values) <= chunksize:
+        return _crunch(kind, values, sec, kwargs)
+
+    data = np.ascontiguousarray(sec.get_sec())
+    y_axis = list(sec.get_y_axis())
+    x_axis = list(sec.get_x_axis())
+    block = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+    try:
+        np.ndarray(data.shape, dtype=data.dtype, buffer=block.buf)[...] = data
+        tasks = [(kind, values[i:i + chunksize], kwargs) for i in range(0, len(values), chunksize)]
+        pool = mp.Pool(processes, initializer=_init_shared_worker,
+                       initargs=(block.name, data.shape, data.dtype, y_axis, x_axis))
+        try:
+            results = []
+            for chunk in pool.imap(_crunch_task, tasks):  # imap keeps the order of the tasks
+                results.extend(chunk)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        block.close()
+        block.unlink()
+    return results
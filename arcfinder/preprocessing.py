@@ -0,0 +1,285 @@
+"""
+the preprocessing of the dynamic spectra (see Dynamic.get_dynamic_spectrum) as a pipeline of stages.
+Every stage declares the statistics of the image it needs. The pipeline goes through the image in
+blocks of rows, which stay in the cache, and in every pass over the blocks it applies one stage
+and gathers the statistics of the next one. All of it happens in the output array, the only
+full-size temporary is the copy of the valid values that the median is taken of (none with
+ReplaceNonValues(chunked=True), so the output can be a memory map of an image larger than the memory).
+"""
+import time
+import tracemalloc
+import numpy as np
+
+
+class Stage:
+    """
+    a step of the pipeline. statistics names what the stage needs to know about the image before
+    it is applied: 'valid' (the values other than 0 and NaN), 'moments' (count, mean and variance),
+    'row_sums' and 'col_sums'.
+    """
+    name = 'stage'
+    statistics = ()
+
+    def prepare(self, stats):
+        """
+        called with the statistics once they are gathered
+        :param stats: dict of the statistics, shared by all stages (earlier stages put their results there).
+               It also holds the 'shape' of the image, the 'image' itself and a function giving its 'blocks'.
+        """
+        pass
+
+    def apply(self, block, rows):
+        """
+        changes a block of the image in place
+        :param block: rows of the image
+        :param rows: slice of those rows
+        """
+        pass
+
+
+class ReplaceNonValues(Stage):
+    """
+    replaces 0 and NaN with the median of the other values (see repl_nonvals_wmed)
+    """
+    name = 'replace_nonvalues'
+    statistics = ('valid',)
+
+    def __init__(self, chunked=False):
+        """
+        :param chunked: take the median with chunked_median, reading the image block by block,
+               instead of from a copy of all valid values (for images larger than the memory)
+        """
+        self.chunked = chunked
+        if chunked:
+            self.statistics = ()
+
+    def prepare(self, stats):
+        if self.chunked:
+            self.median = stats['image'].dtype.type(chunked_median(
+                lambda: (block[~((block == 0) | np.isnan(block))] for block in stats['blocks']())))
+        else:
+            self.median = np.median(stats['valid'], overwrite_input=True)
+        stats['median'] = self.median
+
+    def apply(self, block, rows):
+        mask = block == 0
+        mask |= np.isnan(block)
+        np.putmask(block, mask, self.median)
+
+
+class ClipOutliers(Stage):
+    """
+    replaces the values at least sigma standard deviations above the median with the median
+    """
+    name = 'clip_outliers'
+    statistics = ('moments',)
+
+    def __init__(self, sigma=9):
+        self.sigma = sigma
+
+    def prepare(self, stats):
+        self.median = stats['median']
+        std = np.sqrt(stats['moments'][2]).astype(np.asarray(self.median).dtype)
+        self.threshold = self.median + (float(self.sigma) * std)
+
+    def apply(self, block, rows):
+        np.putmask(block, block >= self.threshold, self.median)
+
+
+class NormalizeAxis(Stage):
+    """
+    makes the means of all rows ('y') or columns ('x') the same (see arr_normalize_axis)
+    """
+    def __init__(self, axis):
+        if axis not in ['y', 'x']:
+            raise Exception("invalid axis specification.")
+        self.axis = axis
+        self.name = 'normalize_' + axis
+        self.statistics = ('row_sums',) if axis == 'y' else ('col_sums',)
+
+    def prepare(self, stats):
+        sums = stats['row_sums'] if self.axis == 'y' else stats['col_sums']
+        means = sums / (stats['shape'][1] if self.axis == 'y' else stats['shape'][0])
+        self.scale = np.mean(means) / means
+
+    def apply(self, block, rows):
+        if self.axis == 'y':
+            block *= self.scale[rows, np.newaxis]
+        else:
+            block *= self.scale
+
+
+class Pipeline:
+    """
+    runs stages over an image, see the top of this module. After run, report has an entry for every
+    pass with the stage it applied ('copy' for the first one), the time and, if profiled, the peak
+    of the memory allocated. A pass includes gathering the statistics of the following stage.
+    """
+    def __init__(self, stages, block_size=2 ** 18):
+        """
+        :param stages: list of Stage objects, applied in this order
+        :param block_size: number of elements per block
+        """
+        self.stages = stages
+        self.block_size = block_size
+        self.report = []
+
+    def run(self, data, rotate=False, dtype=np.float64, profile=False, out=None):
+        """
+        :param data: 2D array, it isn't changed
+        :param rotate: process np.rot90(data)
+        :param dtype: dtype of the result
+        :param profile: measure the memory of every pass with tracemalloc
+        :param out: array for the result (default: a new one)
+        :return: the preprocessed image
+        """
+        image = np.rot90(data) if rotate else data
+        if out is None:
+            out = np.empty(image.shape, dtype=dtype)
+        ny, nx = out.shape
+        step = max(1, self.block_size // max(nx, 1))
+        blocks = [slice(start, min(start + step, ny)) for start in range(0, ny, step)]
+        stats = {'shape': out.shape, 'image': out, 'blocks': lambda: (out[rows] for rows in blocks)}
+        started = profile and not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        self.report = []
+        try:
+            def copy(block, rows):
+                block[...] = image[rows]
+
+            apply, name = copy, 'copy'
+            for stage in self.stages + [None]:
+                needed = stage.statistics if stage is not None else ()
+                if profile:
+                    tracemalloc.reset_peak()
+                    base = tracemalloc.get_traced_memory()[0]
+                start_time = time.perf_counter()
+                gathered = Statistics(needed, out.shape)
+                for rows in blocks:
+                    block = out[rows]
+                    apply(block, rows)
+                    gathered.add(block, rows)
+                stats.update(gathered.result())
+                if stage is not None:
+                    stage.prepare(stats)
+                self.report.append({'stage': name, 'seconds': time.perf_counter() - start_time,
+                                    'peak_bytes': tracemalloc.get_traced_memory()[1] - base if profile else None})
+                if stage is not None:
+                    apply, name = stage.apply, stage.name
+        finally:
+            if started:
+                tracemalloc.stop()
+        return out
+
+
+class Statistics:
+    """
+    gathers the statistics of the image block by block
+    """
+    def __init__(self, names, shape):
+        self.names = names
+        self.valid = []
+        self.count, self.mean, self.m2 = 0, 0., 0.
+        self.row_sums = np.zeros(shape[0])
+        self.col_sums = np.zeros(shape[1])
+
+    def add(self, block, rows):
+        if 'valid' in self.names:
+            mask = block == 0
+            mask |= np.isnan(block)
+            self.valid.append(block[~mask])
+        if 'moments' in self.names:  # merging the mean and the squared deviations of the blocks
+            count = block.size
+            mean = np.mean(block, dtype=np.float64)
+            m2 = np.sum(np.square(np.subtract(block, mean, dtype=np.float64)))
+            delta = mean - self.mean
+            total = self.count + count
+            self.mean += delta * count / total
+            self.m2 += m2 + delta ** 2 * self.count * count / total
+            self.count = total
+        if 'row_sums' in self.names:
+            self.row_sums[rows] = np.sum(block, axis=1, dtype=np.float64)
+        if 'col_sums' in self.names:
+            self.col_sums += np.sum(block, axis=0, dtype=np.float64)
+
+    def result(self):
+        stats = {}
+        if 'valid' in self.names:
+            stats['valid'] = np.concatenate(self.valid) if self.valid else np.array([])
+        if 'moments' in self.names:
+            stats['moments'] = (self.count, self.mean, self.m2 / self.count)
+        if 'row_sums' in self.names:
+            stats['row_sums'] = self.row_sums
+        if 'col_sums' in self.names:
+            stats['col_sums'] = self.col_sums
+        return stats
+
+
+def dynamic_pipeline(normalize_frequency=False, normalize_time=True, outliers_sigma=9, block_size=2 ** 18,
+                     chunked=False):
+    """
+    the pipeline of Dynamic.get_dynamic_spectrum
+    :param chunked: see ReplaceNonValues
+    :return: Pipeline object
+    """
+    stages = [ReplaceNonValues(chunked), ClipOutliers(outliers_sigma)]
+    if normalize_frequency:
+        stages.append(NormalizeAxis('y'))
+    if normalize_time:
+        stages.append(NormalizeAxis('x'))
+    return Pipeline(stages, block_size)
+
+
+def chunked_select(chunks, k, nbins=4096, max_candidates=2 ** 20):
+    """
+    finds the k-th smallest value of data that is only read in chunks. Histograms of the chunks
+    narrow down the range of the value until the candidates left fit in memory.
+    :param chunks: function returning an iterator over the chunks (1D arrays) of the data, it is
+           called once per pass over the data. Complex values are ordered like numpy sorts them,
+           by their real and then by their imaginary part.
+    :param k: rank of the value, starting at 0
+    :param nbins: number of bins of the histograms
+    :param max_candidates: number of values that may be held at once
+    :return: the k-th smallest value
+    """
+    lo, hi = np.inf, -np.inf
+    for chunk in chunks():
+        if len(chunk):
+            lo, hi = min(lo, np.min(chunk.real)), max(hi, np.max(chunk.real))
+    below = 0  # number of values smaller than lo
+    while True:
+        counts = np.zeros(nbins, dtype=int)
+        for chunk in chunks():
+            real = chunk.real[(chunk.real >= lo) & (chunk.real <= hi)]
+            if lo < hi:
+                counts += np.bincount(np.minimum(((real - lo) / (hi - lo) * nbins).astype(int), nbins - 1),
+                                      minlength=nbins)
+            else:
+                counts[0] += len(real)
+        if np.sum(counts) <= max_candidates or lo == hi:
+            candidates = np.sort(np.concatenate([chunk[(chunk.real >= lo) & (chunk.real <= hi)]
+                                                 for chunk in chunks()]))
+            return candidates[k - below]
+        cumulative = np.cumsum(counts)
+        b = int(np.searchsorted(cumulative, k - below, side='right'))
+        below += int(cumulative[b - 1]) if b > 0 else 0
+        new_lo, new_hi = np.inf, -np.inf  # the range of the values in bin b
+        for chunk in chunks():
+            real = chunk.real[(chunk.real >= lo) & (chunk.real <= hi)]
+            real = real[np.minimum(((real - lo) / (hi - lo) * nbins).astype(int), nbins - 1) == b]
+            if len(real):
+                new_lo, new_hi = min(new_lo, np.min(real)), max(new_hi, np.max(real))
+        lo, hi = new_lo, new_hi
+
+
+def chunked_median(chunks):
+    """
+    the median of data that is only read in chunks (see chunked_select)
+    :param chunks: function returning an iterator over the chunks (1D arrays) of the data
+    :return: the median, like np.median
+    """
+    n = sum(len(chunk) for chunk in chunks())
+    if n % 2:
+        return chunked_select(chunks, n // 2)
+    return (chunked_select(chunks, n // 2 - 1) + chunked_select(chunks, n // 2)) / 2.
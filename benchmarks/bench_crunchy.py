@@ -0,0 +1,134 @@
+"""
+compares the speed of crunchy_etas with the per-pixel loop that crunchy used before it
+(copied below from the first version of multiprocessing_helper_functions) on a random
+secondary spectrum. Run from anywhere, e.g.:
+    python benchmarks/bench_crunchy.py --shape 256 512 --etas 5
+The old loop takes a few seconds per eta and 10^5 pixels, keep the sizes moderate. Its results
+differ by about 1e-5 (relative), the old closed-form roots of the cubic are less exact.
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from arcfinder.multiprocessing_helper_functions import SecondaryView, crunchy_etas, gaussian
+
+
+def old_closest_point_on_the_parabola(a, px, py):
+    thingy1 = 2. * a * py
+    thingy2 = np.sqrt(-3 + 0j)
+    thingy3 = 2 ** (1 / 3.)
+    thingy4 = 2 ** (2 / 3.)
+    thingy = (-108. * a ** 4 * px + np.sqrt(11664. * a ** 8 * px ** 2 - 864. * a ** 6 * (-1 + thingy1) ** 3 + 0j)) ** (
+        1 / 3.)
+    Aone = (thingy3 * (-1. + thingy1))
+    Atwo = thingy
+    Athree = thingy
+    Afour = (6. * thingy3 * a ** 2)
+    Bone = ((1. + thingy2) * (-1. + thingy1))
+    Btwo = (thingy4 * thingy)
+    Bthree = ((1. - thingy2) * thingy)
+    Bfour = (12. * thingy3 * a ** 2)
+    Cone = (1. - thingy2) * (-1 + thingy1)
+    Ctwo = thingy4 * thingy
+    Cthree = (1. + thingy2) * thingy
+    Cfour = 12. * thingy3 * a ** 2
+
+    A = -np.real(Aone / Atwo + Athree / Afour)
+    B = np.real(Bone / Btwo + Bthree / Bfour)
+    C = np.real(Cone / Ctwo + Cthree / Cfour)
+
+    solns = [A, B, C]
+    solns_temp = []
+    for soln in solns:
+        solns_temp.append(np.abs(soln - px))
+
+    val, idx = min((val, idx) for (idx, val) in enumerate(solns_temp))
+    return solns[idx]
+
+
+def old_weight_function(eta, px, py, sigma=[1, 1]):
+    x = old_closest_point_on_the_parabola(eta, px, py)
+    y = eta * x ** 2
+    dist_from_origin = np.sqrt(px ** 2 + py ** 2)
+    ret_y = gaussian(py - y, 0, sigma[0])
+    ret_x = gaussian(px - x, 0, sigma[1])
+    ret = dist_from_origin * np.sqrt(ret_x * ret_y)
+    if ret < (1 / np.e ** 3):
+        ret = None
+    return ret
+
+
+def old_crunchy(eta, sec, hand=None, sigma=None):
+    powers = []
+    powers_norm = []
+
+    y_axis = sec.get_y_axis()
+    x_axis = sec.get_x_axis()
+    if sigma is None:
+        sigma = [np.absolute(y_axis[1] - y_axis[0]),
+                 np.absolute(x_axis[1] - x_axis[0])]
+
+    for yi in range(len(y_axis)):
+        y = y_axis[yi]
+        for xi in range(len(x_axis)):
+            x = x_axis[xi]
+            this_weight = old_weight_function(eta, x, y, sigma)
+            if this_weight is None:
+                powers.append(None)
+                powers_norm.append(None)
+            else:
+                variance = 1 / this_weight
+                powers.append(sec.get([yi, xi]) / variance)
+                powers_norm.append(1 / variance)
+    p = np.nansum(list(filter(None, powers)))
+    pn = np.nansum(list(filter(None, powers_norm)))
+    return eta, p / pn
+
+
+def best_time(function, repeat):
+    """
+    :return: the shortest of repeat runs in seconds and the result of the last one
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of crunchy_etas against the old per-pixel crunchy')
+    parser.add_argument('--shape', type=int, nargs=2, default=[128, 256], help='delay and fringe pixels')
+    parser.add_argument('--etas', type=int, default=3, help='number of curvatures')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of the new code, the best one counts')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    ny, nx = args.shape
+    rng = np.random.default_rng(args.seed)
+    y_axis = np.linspace(5., 0., ny)  # descending like the delay axis of Secondary
+    x_axis = np.linspace(-4., 4., nx)
+    sec = SecondaryView(rng.random((ny, nx)), y_axis, x_axis)
+    etas = list(np.geomspace(0.05, 5., args.etas))
+    # the old sec.get copied the whole secondary spectrum for every pixel (Indexed2D.get_data),
+    # SecondaryView.get doesn't, so the old times are on the low side
+
+    old_time, old = best_time(lambda: [old_crunchy(eta, sec) for eta in etas], 1)
+    rows = [('old crunchy loop', old_time, old)]
+    for name, band in [('crunchy_etas, dense', False), ('crunchy_etas, band', True)]:
+        seconds, new = best_time(lambda: crunchy_etas(etas, sec, band=band), args.repeat)
+        rows.append((name, seconds, new))
+
+    print('secondary spectrum {0}x{1}, {2} etas'.format(ny, nx, len(etas)))
+    for name, seconds, result in rows:
+        error = np.max(np.abs(np.array([p for _, p in result]) / np.array([p for _, p in old]) - 1.))
+        print('{0:22} {1:10.4f} s {2:10.1f}x  max relative difference {3:.1e}'.format(
+            name, seconds, old_time / seconds, error))
+
+
+if __name__ == '__main__':
+    main()
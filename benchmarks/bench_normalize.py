@@ -0,0 +1,94 @@
+"""
+compares the speed of repl_nonvals_wmed and arr_normalize_axis with the loops they had before
+(copied below from the first version of computing) on a random dynamic spectrum with zeros and
+NaNs. Run from anywhere, e.g. at the typical size of our observations:
+    python benchmarks/bench_normalize.py --shape 2048 8192
+The old repl_nonvals_wmed visits every element in Python, at that size it takes about a minute.
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from arcfinder.computing import arr_normalize_axis, repl_nonvals_wmed
+
+
+def old_arr_normalize_axis(arr, axis=None, mask=None):  # with == instead of "is" for the strings
+    if axis is None:
+        return arr
+    elif axis == 'y':
+        if mask is None:
+            mask = [1.]*len(arr[0])
+        mean = 0.
+        for row in arr:
+            mean += np.mean(mask * row)
+        mean /= float(len(arr))
+        for row in arr:
+            this_mean = np.mean(mask * row)
+            row *= mean / this_mean
+        return arr
+    elif axis == 'x':
+        return old_arr_normalize_axis(arr.T, axis='y', mask=mask).T
+    else:
+        raise Exception("invalid axis specification.")
+
+
+def old_repl_nonvals_wmed(array):
+    index = np.where(np.logical_or(array < 0., array > 0.))
+    median = np.median(array[index])
+    for row in range(len(array)):
+        for col in range(len(array[row])):
+            if array[row][col] == 0 or np.isnan(array[row][col]):
+                array[row][col] = median
+    return array, median
+
+
+def best_time(function, data, repeat):
+    """
+    runs function on fresh copies of data
+    :return: the shortest of repeat runs in seconds and the result of the last one
+    """
+    times = []
+    for _ in range(repeat):
+        copy = np.array(data)
+        start = time.perf_counter()
+        result = function(copy)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the cleaning functions against their old loops')
+    parser.add_argument('--shape', type=int, nargs=2, default=[512, 2048], help='channels and subintegrations')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of the new code, the best one counts')
+    parser.add_argument('--old-repeat', type=int, default=1, help='runs of the old code')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    data = rng.random(args.shape) + 1.
+    data[rng.random(data.shape) < 0.01] = 0.
+    data[rng.random(data.shape) < 0.01] = np.nan
+    clean = old_repl_nonvals_wmed(np.array(data))[0]
+    quarter = [1. if i < data.shape[0] / 4. else 0. for i in range(data.shape[0])]  # the mask of Secondary
+
+    cases = [
+        ('repl_nonvals_wmed', data, lambda a: old_repl_nonvals_wmed(a)[0], lambda a: repl_nonvals_wmed(a)[0]),
+        ("normalize 'y'", clean, lambda a: old_arr_normalize_axis(a, 'y'), lambda a: arr_normalize_axis(a, 'y')),
+        ("normalize 'x'", clean, lambda a: old_arr_normalize_axis(a, 'x'), lambda a: arr_normalize_axis(a, 'x')),
+        ("normalize 'x', mask", clean, lambda a: old_arr_normalize_axis(a, 'x', quarter),
+         lambda a: arr_normalize_axis(a, 'x', quarter)),
+    ]
+    print('dynamic spectrum {0}x{1}'.format(*data.shape))
+    for name, case_data, old, new in cases:
+        old_time, old_result = best_time(old, case_data, args.old_repeat)
+        new_time, new_result = best_time(new, case_data, args.repeat)
+        error = np.max(np.abs(new_result / old_result - 1.))
+        print('{0:20} old {1:9.4f} s  new {2:9.4f} s {3:9.1f}x  max relative difference {4:.1e}'.format(
+            name, old_time, new_time, old_time / new_time, error))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,10 +4,23 @@ import functions
 
 import os
 import sqlite3
+import hashlib
 import glob
 import numpy as np
 import warnings
 import io
+import multiprocessing as mp
+from collections import deque, OrderedDict
+
+# columns of headers that identify the ingested file, so that unchanged files can be skipped
+file_columns = [('file_path', 'TEXT'), ('file_size', 'INTEGER'), ('file_mtime', 'REAL'), ('file_hash', 'TEXT')]
+# header keywords that extract often filters on; they get an index once they are columns
+indexed_columns = ['MJD', 'FREQ', 'SOURCE', 'ORIGIN']
+# columns of headers that aren't FITS header keywords
+base_columns = [('id', 'INTEGER PRIMARY KEY'), ('filename', 'TEXT UNIQUE ON CONFLICT REPLACE'),
+                ('ctime', 'DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP'),
+                ('mtime', 'DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP'),
+                ('keywords', 'TEXT DEFAULT NULL')] + file_columns
 
 
 def adapt_array(arr):
@@ -44,8 +57,7 @@ class Files:
                 self.fits = fits
                 self.imported_fits = True
             except ImportError:
-                print('For this type of action, the python package "astropy" is needed.')
-                exit(1)
+                raise ImportError('For this type of action, the python package "astropy" is needed.')
 
     def import_psrchive(self):
         if not self.imported_psrchive:
@@ -54,18 +66,23 @@ class Files:
                 self.psrchive = psrchive
                 self.imported_psrchive = True
             except ImportError:
-                print('For this type of action, psrchive must be installed, and the python interface available.\n'
-                      'PSRchive also only works with python2')
-                exit(1)
+                raise ImportError('For this type of action, psrchive must be installed, and the python interface '
+                                  'available.\nPSRchive also only works with python2')
 
-    def __init__(self, file, debug=False, verbose=False):
-        self.file = file[0]
+    def __init__(self, file, debug=False, verbose=False, dtype=None):
+        """
+        :param file: list of filenames, can include wildcards; None for an object that only parses
+               the files it is given (see parse_file)
+        :param dtype: numpy dtype the data is converted to, e.g. np.float32; None keeps the dtype of the files
+        """
+        self.file = file[0] if file else None
         self.debug = debug
+        self.dtype = dtype
         self.imported_fits = False
         self.imported_psrchive = False
         self.fits = None
         self.psrchive = None
-        self.files = self.get_file_list(file)
+        self.files = self.get_file_list(file) if file else []
         self.verbose = verbose
         if not debug:
             warnings.simplefilter('ignore', UserWarning)
@@ -97,6 +114,8 @@ class Files:
         astrodata = hdulist[0].data
 
         header = self.fix_header(header)
+        if self.dtype is not None and astrodata is not None:
+            astrodata = astrodata.astype(self.dtype, copy=False)  # BITPIX follows the dtype when writing
         hdulist[0].header = header
         hdulist[0].data = astrodata
         # hdulist.close()
@@ -139,7 +158,7 @@ class Files:
         tot_prof = tot.get_Profile(0, 0, 0)
         prof_shift.set_standard(tot_prof)
 
-        dyn = np.empty(shape=[nsubint, nchan])
+        dyn = np.empty(shape=[nsubint, nchan], dtype=self.dtype if self.dtype is not None else np.float64)
         for i in range(nsubint):
             for j in range(nchan):
                 profile = ar.get_Profile(i, 0, j)
@@ -147,7 +166,8 @@ class Files:
                 dyn[i, j] = prof_shift.get_snr()*profile.get_weight()
 
         header = {'FREQ': freq, 'BW': bw, 'NCHAN': nchan, 'NSUB': nsubint, 'T_INT': int_len, 'SOURCE': source,
-                  'ORIGIN': origin, 'MJD': mjd, 'NAXIS': 2, 'NAXIS1': len(dyn[0]), 'NAXIS2': len(dyn), 'BITPIX': 32, 'DM': dm}
+                  'ORIGIN': origin, 'MJD': mjd, 'NAXIS': 2, 'NAXIS1': len(dyn[0]), 'NAXIS2': len(dyn), 'BITPIX': -8 * dyn.itemsize,
+                  'DM': dm}
 
         fits_header = self.fits.Header()  # prepare FITS header
         for key in header:
@@ -170,8 +190,7 @@ class Files:
             try:
                 hdulist, header, astrodata = self.get_data_fits(file)
             except OSError:
-                print('{0} is not a FITS file'.format(file))
-                exit(1)
+                raise IOError('{0} is not a FITS file'.format(file))
         elif ext in ['.ar']:
             hdulist, header, astrodata = self.get_data_ar(file)
             # try:
@@ -192,6 +211,46 @@ class Files:
         # print('header', header)
         return hdulist, header, astrodata
 
+    def parse_file(self, file):
+        """
+        Reads a file with get_data, without raising if it fails
+        :param file: filename
+        :return: tuple of the filename, header, data and the error message (None if it didn't fail)
+        """
+        try:
+            hdulist, header, astrodata = self.get_data(file)
+        except Exception as e:
+            return file, None, None, str(e) or e.__class__.__name__
+        return file, header, astrodata, None
+
+    def parse_files(self, files, workers=1, queue_size=None):
+        """
+        Reads files with parse_file in a pool of worker processes. At most queue_size files are
+        parsed or waiting to be taken at a time, so the memory doesn't grow with the number of files.
+        :param files: list of filenames
+        :param workers: number of worker processes; 1 parses the files in this process
+        :param queue_size: maximum number of files in flight, defaults to twice the number of workers
+        :return: generator of the results of parse_file, in the order of files
+        """
+        if workers == 1:
+            for file in files:
+                yield self.parse_file(file)
+            return
+        queue_size = queue_size or 2 * workers
+        pool = mp.Pool(workers, initializer=_init_parser, initargs=(self.debug, self.dtype))
+        try:
+            pending = deque()
+            for file in files:
+                pending.append(pool.apply_async(_parse_file, (file,)))
+                if len(pending) >= queue_size:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+            pool.close()
+        finally:
+            pool.terminate()  # also when the caller stops early
+            pool.join()
+
     def fix_header(self, header):
         """
         Fix header fields: remove empty headers, set None where no familiar value is specified
@@ -214,10 +273,12 @@ class DB(Files):
     """
     FitsDB class for storing fits files in a sqlite database
     """
-    def __init__(self, file, debug=False, verbose=False):
+    def __init__(self, file, debug=False, verbose=False, dtype=None):
         functions.check_object_type(file, list)
-        Files.__init__(self, file, debug, verbose)
+        Files.__init__(self, file, debug, verbose, dtype)
         self.fraction = 0
+        self.unchanged = []  # files skipped by the last ingest_data, because they didn't change
+        self.columns = None  # cache of get_column_types
         db = os.access(self.file, os.F_OK)
         self.conn = sqlite3.connect(self.file, detect_types=sqlite3.PARSE_DECLTYPES)
         self.conn.row_factory = sqlite3.Row  # makes the results of querys a dict instead of a tuple
@@ -225,6 +286,8 @@ class DB(Files):
         if os.path.isfile(self.file):
             if not db:
                 self.create_table()
+            self.add_file_columns()
+            self.create_indexes()
 
         self.cursor.execute("PRAGMA locking_mode=EXCLUSIVE;")
         sqlite3.enable_callback_tracebacks(True)
@@ -237,19 +300,8 @@ class DB(Files):
         """
         Create the SQLite tables
         """
-        command = 'CREATE TABLE IF NOT EXISTS headers (' \
-                  'id INTEGER PRIMARY KEY, ' \
-                  'filename TEXT UNIQUE ON CONFLICT REPLACE, ' \
-                  'ctime DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP, ' \
-                  'mtime DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP, ' \
-                  'keywords TEXT DEFAULT NULL);'
-        self.cursor.execute(command)
-
-        command = 'CREATE TRIGGER IF NOT EXISTS headers_update_trigger AFTER UPDATE ON headers FOR EACH ROW ' \
-                  'BEGIN ' \
-                  'UPDATE headers SET mtime=CURRENT_TIMESTAMP WHERE id=NEW.id; ' \
-                  'END'
-        self.cursor.execute(command)
+        self.cursor.execute(headers_table_command('headers'))
+        self.create_trigger()
 
         command = 'CREATE TABLE IF NOT EXISTS astrodata (' \
                   'headers_id INTEGER REFERENCES headers(id) ON DELETE CASCADE, '\
@@ -258,6 +310,29 @@ class DB(Files):
 
         self.conn.commit()
 
+    def create_indexes(self, commit=True):
+        """
+        Creates the missing indexes: on the columns of indexed_columns that exist and on astrodata.headers_id.
+        SQLite keeps them up to date itself.
+        :param commit: commit them; otherwise they are part of the current transaction
+        """
+        columns = self.get_columns()
+        if not columns:  # no headers table
+            return
+        for column in indexed_columns:
+            if column in columns:
+                self.cursor.execute('CREATE INDEX IF NOT EXISTS "headers_{0}" ON headers ("{0}")'.format(column))
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS astrodata_headers_id ON astrodata (headers_id)')
+        if commit:
+            self.conn.commit()
+
+    def create_trigger(self):
+        command = 'CREATE TRIGGER IF NOT EXISTS headers_update_trigger AFTER UPDATE ON headers FOR EACH ROW ' \
+                  'BEGIN ' \
+                  'UPDATE headers SET mtime=CURRENT_TIMESTAMP WHERE id=NEW.id; ' \
+                  'END'
+        self.cursor.execute(command)
+
     def get_id(self, filename):
         """
         Return the id of the row that matches that filename. Return [] if there is no match. Raise AssertionError if
@@ -279,140 +354,376 @@ class DB(Files):
         :param command: SQL-statement
         :return: matching rows
         """
+        self.columns = None  # the statement could change the columns
         self.cursor.execute(command)
         res = self.cursor.fetchall()
         return res
 
     def get_columns(self):
         """
-        Get a list of columns from the headers table
+        Get a list of columns from the headers table. The list is cached until the columns change.
         :return: List of columns
         """
-        self.cursor.execute('PRAGMA table_info(headers)')
-        res = self.cursor.fetchall()
-        return [re[1] for re in res]  # re[0-4] are column number, name, type, notnull, default value, PRIMARY_KEY
+        return list(self.get_column_types())
+
+    def get_column_types(self):
+        """
+        Get the declared types of the columns of the headers table, cached like get_columns
+        :return: OrderedDict of the columns and their types ('' for untyped columns)
+        """
+        if self.columns is None:
+            self.cursor.execute('PRAGMA table_info(headers)')
+            res = self.cursor.fetchall()
+            # re[0-5] are column number, name, type, notnull, default value, PRIMARY_KEY
+            self.columns = OrderedDict((re[1], re[2].upper()) for re in res)
+        return OrderedDict(self.columns)
+
+    def add_file_columns(self):
+        """
+        Adds the columns of file_columns to databases created before they existed
+        """
+        columns = self.get_columns()
+        if not columns:  # no headers table
+            return
+        for name, type_ in file_columns:
+            if name not in columns:
+                self.cursor.execute('ALTER TABLE headers ADD "{0}" {1}'.format(name, type_))
+        self.conn.commit()
+        self.columns = None
+
+    def select_by_filename(self, fields, filenames):
+        """
+        Return fields of the rows that match the filenames, with one query per 500 filenames
+        :param fields: list of columns
+        :param filenames: list of filenames (their basenames are compared)
+        :return: dict of basename: row
+        """
+        names = list(set(os.path.basename(filename) for filename in filenames))
+        rows = {}
+        for start in range(0, len(names), 500):  # stays below the maximum number of SQL variables
+            chunk = names[start:start + 500]
+            command = 'SELECT filename, {0} FROM headers WHERE filename IN ({1})'.format(
+                ', '.join('"{0}"'.format(field) for field in fields), ', '.join(['?'] * len(chunk)))
+            self.cursor.execute(command, chunk)
+            for row in self.cursor.fetchall():
+                rows[row[0]] = row
+        return rows
+
+    def get_ids(self, filenames):
+        """
+        Return the ids of the rows that match the filenames, with a single query
+        :param filenames: list of filenames (their basenames are compared)
+        :return: dict of basename: id, for the filenames that are in the database
+        """
+        return dict((name, row['id']) for name, row in self.select_by_filename(['id'], filenames).items())
 
-    def check_columns(self, headers):
+    def get_changed_files(self, files, content_hash=False):
+        """
+        Finds the files that differ from what was ingested from them: files whose basename isn't
+        in the database, that were ingested from another path or whose size or modification time
+        changed (or, with content_hash, whose content changed).
+        :param files: list of filenames
+        :param content_hash: compare a hash of the content as well (reads the files, but doesn't parse them)
+        :return: tuple of the list of changed files and a dict of filename: (path, size, mtime, hash)
+                 of all files, with hash None unless content_hash
+        """
+        rows = self.select_by_filename([name for name, _ in file_columns], files)
+        changed, infos = [], {}
+        for file in files:
+            infos[file] = file_info(file, content_hash)
+            row = rows.get(os.path.basename(file))
+            if row is None or tuple(row[name] for name, _ in file_columns[:3]) != infos[file][:3] or \
+                    content_hash and row['file_hash'] != infos[file][3]:
+                changed.append(file)
+        return changed, infos
+
+    def check_columns(self, headers, commit=True):
         """
         Checks the database if the header exists as a column in the database
-        If not, it adds a column
-        :param headers: list of headers
+        If not, it adds a column, typed after the value (see sql_type). The columns are looked up
+        in the cached list of get_columns.
+        :param headers: list of headers, or dict of headers and their values
+        :param commit: commit the new columns; otherwise they are part of the current transaction
         :rtype: None
         """
         self.import_fits()
         columns = self.get_columns()
+        values = headers if isinstance(headers, dict) else {}
+        new = []
         for header in headers:
-            if header not in columns and header is not '':
-                self.cursor.execute('ALTER TABLE headers ADD "%s" NUMERIC' % header)
-                columns.append(header)
-        self.conn.commit()
+            if header not in columns and header != '' and header not in new:
+                new.append(header)
+        for header in new:
+            self.columns[header] = sql_type(values.get(header))
+            self.cursor.execute('ALTER TABLE headers ADD "{0}" {1}'.format(header, self.columns[header]))
+        if any(header in indexed_columns for header in new):
+            self.create_indexes(commit=False)
+        if commit and new:
+            self.conn.commit()
+
+    def compact(self):
+        """
+        Rebuilds the headers table: drops the header columns that have no values in any row and
+        gives the others the type of their values (INTEGER, REAL or TEXT; NUMERIC if they are mixed),
+        then VACUUMs the database. Databases ingested with NUMERIC columns for every keyword
+        are migrated this way. The ids stay the same, so astrodata still matches.
+        :return: dict with the dropped columns ('dropped'), the columns with a new type ('retyped')
+                 and the size of the database file before and after ('size')
+        """
+        self.cursor.execute('PRAGMA table_info(headers)')
+        declared = [(re[1], re[2]) for re in self.cursor.fetchall()]
+        base = [name for name, _ in base_columns]
+        kept, dropped, retyped = [], [], {}
+        for name, type_ in declared:
+            if name in base:
+                continue
+            self.cursor.execute('SELECT DISTINCT typeof("{0}") FROM headers'.format(name))
+            types = set(row[0] for row in self.cursor.fetchall()) - set(['null'])
+            if not types:
+                dropped.append(name)
+                continue
+            if types == set(['integer']):
+                new_type = 'INTEGER'
+            elif types <= set(['integer', 'real']):
+                new_type = 'REAL'
+            elif types == set(['text']):
+                new_type = 'TEXT'
+            else:
+                new_type = 'NUMERIC'
+            if new_type != type_.upper():
+                retyped[name] = new_type
+            kept.append((name, new_type))
+
+        size_before = os.path.getsize(self.file)
+        if self.conn.in_transaction:
+            self.conn.commit()
+        self.cursor.execute('BEGIN')
+        try:
+            self.cursor.execute(headers_table_command('headers_compact', kept))
+            names = ', '.join('"{0}"'.format(name) for name in [n for n, _ in declared if n in base] +
+                              [n for n, _ in kept])
+            self.cursor.execute('INSERT INTO headers_compact ({0}) SELECT {0} FROM headers'.format(names))
+            self.cursor.execute('DROP TABLE headers')  # drops the trigger too
+            self.cursor.execute('ALTER TABLE headers_compact RENAME TO headers')
+            self.create_trigger()
+            self.columns = None
+            self.create_indexes(commit=False)  # the indexes of the old table were dropped with it
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+        finally:
+            self.columns = None
+        self.cursor.execute('VACUUM')
+        return {'dropped': dropped, 'retyped': retyped, 'size': (size_before, os.path.getsize(self.file))}
 
     def report_percentage(self):
         return round(self.fraction*100)
 
-    def ingest_data(self, search_list):
+    def ingest_data(self, search_list, batch_size=100, progress=None, workers=1, force=False, content_hash=False):
         """
         Ingest the header information and data with an UPDATE or INSERT.
-        :param search_list:
+        The files are parsed by a pool of worker processes (see parse_files), while this process
+        writes them to the database in transactions of batch_size files each, with one commit per
+        batch. Files that can't be read are reported and skipped. If writing a batch fails, the
+        batch is rolled back and the error is raised; the batches before it stay in the database.
+        :param search_list: list of filenames, can include wildcards
+        :param batch_size: number of files per transaction
+        :param progress: function called with the number of files done and the number of all files
+               after every file (it doesn't wait for the commit)
+        :param workers: number of processes parsing the files
+        :param force: ingest all files; otherwise files that are unchanged since they were ingested
+               are skipped without opening them (see get_changed_files), they are listed in self.unchanged
+        :param content_hash: store a hash of the content of the files and compare it as well
+        :return: list of (filename, error message) of the skipped files
         """
         self.import_fits()
         files = self.get_file_list(search_list)
         if self.debug:
             print(files)
         self.fraction = 0
-        for file in files:
-            header_id = self.get_id(file)     # will be [] if file is not found in the DB
-
-            hdulist, header, astrodata = self.get_data(file)
-
-            self.check_columns(header.keys())
-            if not header_id:  # file not in the database yet
-                # INSERT
-                keys = []
-                keys.extend(['filename', 'keywords'])
-                keys.extend(header.keys())
-
-                command = 'INSERT INTO headers (`'
-                command += '`, `'.join(keys) + '`)'
-                # command += 'filename, ctime, mtime, keywords'
-                # for key in header.keys():
-                #     command += '"' + key + '",'
-
-                values = []
-                values.extend([os.path.basename(file), os.path.relpath(file)])
-                # values.extend([v for v in header.values()])
-                values.extend(header.values())
-
-                command += ' VALUES (' + \
-                           '?, '*(len(header)-1+2) + '?)'        # +2 for the filename and keywords fields
-
-                if self.debug:
-                    log_sql_stmt(self.cursor, command, *values)
-                self.cursor.execute(command, tuple(values))
-                self.conn.commit()
-                # command = 'INSERT INTO astrodata (headers_id, dim1, dim2, DATA) VALUES (?, ?, ?, ?)'
-                # self.cursor.execute(command, (self.cursor.lastrowid, len(astrodata), len(astrodata[0]), astrodata))
-                command = 'INSERT INTO astrodata (headers_id, DATA) VALUES (?, ?)'
-                self.cursor.execute(command, (self.cursor.lastrowid, adapt_array(astrodata)))
-                self.conn.commit()
+        batch_size = max(1, int(batch_size))
+        batch = []
+        failed = []
+        changed, infos = self.get_changed_files(files, content_hash)
+        if force:
+            changed = files
+        to_ingest = set(changed)
+        self.unchanged = [file for file in files if file not in to_ingest]
+        offset = len(files) - len(changed)  # the unchanged files are done already
+        for done, (file, header, astrodata, error) in enumerate(self.parse_files(changed, workers), offset + 1):
+            if error is None:
+                batch.append((file, header, astrodata))
             else:
-                # UPDATE
-                command = 'UPDATE OR ROLLBACK headers SET '
-                for key in header:
-                    command += '"' + key + '" = "' + str(header[key]) + '",'
-                command = command[:-1]
-                command += ' WHERE id = "' + str(header_id[0][0]) + '"'     # get first row and first field (id)
-                self.cursor.execute(command)
-                self.conn.commit()
-                # command = 'UPDATE astrodata SET dim1 = ?, dim2 = ?, DATA = ? WHERE headers_id = ?'
-                # self.cursor.execute(command, (astrodata, len(astrodata), len(astrodata[0]), str(header_id[0][0])))
-                command = 'UPDATE astrodata SET DATA = ? WHERE headers_id = ?'
-                self.cursor.execute(command, (adapt_array(astrodata), str(header_id[0][0])))
-                self.conn.commit()
-            self.fraction += 1/len(files)
+                failed.append((file, error))
+            self.fraction = done / len(files)
+            if progress is not None:
+                progress(done, len(files))
             if self.verbose:
                 print('\r{0}%'.format(self.report_percentage()), end='')
-
-    def extract(self, attributes, writetofile=False):
+            if len(batch) >= batch_size:
+                self.ingest_batch(batch, infos)
+                batch = []
+        if batch:
+            self.ingest_batch(batch, infos)
+        if progress is not None and not changed and files:
+            progress(len(files), len(files))
+        return failed
+
+    def ingest_batch(self, batch, file_infos=None):
         """
-        Extract data from the database
-        :type attributes: dict
-        :return: List of astropy HDU lists
+        Writes parsed files to the database in a single transaction: new files are INSERTed,
+        files that are in the database already are UPDATEd. Rolls back if anything fails.
+        :param batch: list of (filename, header, astrodata) tuples, see get_data
+        :param file_infos: dict of filename: (path, size, mtime, hash) for the columns of
+               file_columns (see get_changed_files); computed without the hash for missing files
+        """
+        file_infos = file_infos or {}
+        latest = {}  # a file that is in the batch twice is ingested once, with its last version
+        for file, header, astrodata in batch:
+            latest.pop(os.path.basename(file), None)
+            latest[os.path.basename(file)] = (file, header, astrodata)
+        if self.conn.in_transaction:
+            self.conn.commit()
+        self.cursor.execute('BEGIN')
+        try:
+            first = OrderedDict()  # the first value of every key that isn't None, for the types of new columns
+            for file, header, astrodata in latest.values():
+                for key, value in header.items():
+                    if first.get(key) is None:
+                        first[key] = value
+            self.check_columns(first, commit=False)
+            ids = self.get_ids(list(latest))
+
+            inserts, updates = {}, {}  # grouped by the header keys, each group is one executemany
+            for name, (file, header, astrodata) in latest.items():
+                header_keys = tuple(header.keys()) + tuple(name for name, _ in file_columns)
+                info = file_infos[file] if file in file_infos else file_info(file)
+                if name not in ids:  # file not in the database yet
+                    values = [name, os.path.relpath(file)]
+                    values.extend(header.values())
+                    values.extend(info)
+                    inserts.setdefault(header_keys, []).append(tuple(values))
+                else:
+                    values = list(header.values())
+                    values.extend(info)
+                    values.append(ids[name])
+                    updates.setdefault(header_keys, []).append(tuple(values))
+
+            for header_keys, rows in inserts.items():
+                keys = ['filename', 'keywords']
+                keys.extend(header_keys)
+                command = 'INSERT INTO headers (`' + '`, `'.join(keys) + '`)'
+                command += ' VALUES (' + ', '.join(['?'] * len(keys)) + ')'
+                if self.debug:
+                    log_sql_stmt(self.cursor, command, *rows[0])
+                self.cursor.executemany(command, rows)
+            for header_keys, rows in updates.items():
+                command = 'UPDATE headers SET ' + ', '.join('"{0}" = ?'.format(key) for key in header_keys)
+                command += ' WHERE id = ?'
+                if self.debug:
+                    log_sql_stmt(self.cursor, command, *rows[0])
+                self.cursor.executemany(command, rows)
+
+            new_ids = self.get_ids([name for name in latest if name not in ids])
+            command = 'INSERT INTO astrodata (headers_id, DATA) VALUES (?, ?)'
+            self.cursor.executemany(command, ((new_ids[name], adapt_array(astrodata))
+                                              for name, (file, header, astrodata) in latest.items()
+                                              if name not in ids))
+            command = 'UPDATE astrodata SET DATA = ? WHERE headers_id = ?'
+            self.cursor.executemany(command, ((adapt_array(astrodata), ids[name])
+                                              for name, (file, header, astrodata) in latest.items() if name in ids))
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            self.columns = None  # new columns are rolled back too
+            raise
+
+    def build_query(self, attributes, substring=False):
+        """
+        Builds the SELECT statement of extract. The conditions can use the indexes (see create_indexes):
+        "a b" is the range a <= value <= b, "=value" is matched exactly, and any other text is a prefix:
+        "B0834" matches "B0834+06". How numbers are matched depends on the type (affinity) of the column:
+        in TEXT columns they are text like any other, so "0735" matches "0735+34"; in INTEGER and REAL
+        columns a single number is matched exactly. NUMERIC columns (every keyword column of databases
+        ingested before the columns were typed, see compact) can hold numbers and text, there a single
+        number matches the numbers that are equal to it and the text values that start with it.
+        Text is compared case-sensitively.
+        :param attributes: dict of columns and the values to search for
+        :param substring: match single text values anywhere in the value with LIKE '%text%'
+               (case-insensitive, but the whole table is scanned)
+        :return: tuple of the statement and its values
         """
         functions.check_object_type(attributes, dict)
-
-        self.import_fits()
-        columns = self.get_columns()
+        columns = self.get_column_types()
         command = 'SELECT * FROM headers '
         command += 'JOIN astrodata ON headers.id = astrodata.headers_id'  # also get the dynamic spectrum
 
+        conditions = []
         values = []
-        if len(attributes) > 0:  # if we have attributes to search for, add the WHERE clause and the attributes
-            command += ' WHERE '
-            for attribute, value in attributes.items():
-                # check if attributes are present in the database
-                if attribute not in columns:
-                    raise NameError("Attribute {0} not found in database".format(attribute))
-                if attribute is 'MJD':
-                    command += '`MJD` >= ? AND `MJD` <= ? AND '
-                    values.extend(value.split(" "))
-                elif attribute is 'FREQ':
-                    command += '`FREQ` >= ? AND `FREQ` <= ? AND '
-                    values.extend(value.split(" "))
-                else:
-                    split = value.split(" ")
-                    if len(split) == 2:
-                        command += '`{0}` >= ? AND `{1}` <= ? AND '.format(attribute, attribute)
-                        values.extend(value.split(" "))
-                    elif len(split) == 1:
-                        command += '{0} LIKE ? AND '.format(attribute)
-                        values.extend(['%'+value+'%'])
-                    else:
-                        raise ValueError("Didn't understand values for attribute {0}".format(attribute))
-            command = command[:-4]  # remove the last "AND "
+        for attribute, value in attributes.items():
+            # check if attributes are present in the database
+            if attribute not in columns:
+                raise NameError("Attribute {0} not found in database".format(attribute))
+            affinity = column_affinity(columns[attribute])
+            convert = str if affinity == 'TEXT' else to_number
+            split = value.split(" ")
+            number = convert(value)
+            if len(split) == 2:
+                conditions.append('`{0}` >= ? AND `{0}` <= ?'.format(attribute))
+                values.extend(convert(v) for v in split)
+            elif len(split) != 1:
+                raise ValueError("Didn't understand values for attribute {0}".format(attribute))
+            elif substring:
+                conditions.append('`{0}` LIKE ?'.format(attribute))
+                values.append('%'+value+'%')
+            elif value.startswith('=') or value == '':
+                conditions.append('`{0}` = ?'.format(attribute))
+                values.append(convert(value[1:] if value.startswith('=') else value))
+            elif not isinstance(number, str) and affinity in ['INTEGER', 'REAL']:
+                conditions.append('`{0}` = ?'.format(attribute))
+                values.append(number)
+            else:
+                # a range instead of LIKE 'value%', which uses the index of TEXT columns. Other columns would
+                # turn numeric bounds into numbers, there the values are compared as text.
+                text = '`{0}`'.format(attribute) if affinity == 'TEXT' else 'CAST(`{0}` AS TEXT)'.format(attribute)
+                prefix = '{0} >= ? AND {0} < ?'.format(text)
+                bounds = [value, value[:-1] + chr(ord(value[-1]) + 1)]
+                if isinstance(number, str):
+                    conditions.append(prefix)
+                    values.extend(bounds)
+                else:  # NUMERIC columns hold numbers and text
+                    conditions.append("(`{0}` = ? OR typeof(`{0}`) = 'text' AND {1})".format(attribute, prefix))
+                    values.extend([number] + bounds)
+        if conditions:
+            command += ' WHERE ' + ' AND '.join(conditions)
+        return command, values
+
+    def query_plan(self, attributes, substring=False):
+        """
+        Shows how SQLite runs the query of extract, e.g. which indexes it uses
+        :param attributes: see build_query
+        :return: list of the lines of EXPLAIN QUERY PLAN
+        """
+        command, values = self.build_query(attributes, substring)
+        self.cursor.execute('EXPLAIN QUERY PLAN ' + command, values)
+        return [row[-1] for row in self.cursor.fetchall()]
+
+    def extract(self, attributes, writetofile=False, substring=False):
+        """
+        Extract data from the database
+        :type attributes: dict
+        :param attributes: columns and the values to search for, see build_query
+        :param substring: see build_query
+        :return: List of astropy HDU lists
+        """
+        self.import_fits()
+        command, values = self.build_query(attributes, substring)
 
         if self.debug:
             log_sql_stmt(self.cursor, command, *values)
+            for line in self.query_plan(attributes, substring):
+                print('Query plan: ' + line)
         self.cursor.execute(command, values)
         rows = self.cursor.fetchall()
 
@@ -448,13 +759,16 @@ class DB(Files):
         header = self.fits.Header()
         for key in row.keys():
             key = str(key)
-            if key in ['id', 'filename', 'ctime', 'mtime', 'keywords', 'headers_id', 'DATA']:
+            if key in ['id', 'filename', 'ctime', 'mtime', 'keywords', 'headers_id', 'DATA'] or \
+                    key in [name for name, _ in file_columns]:
                 # we don't want those in the FITS-header
                 continue
             header.extend([(key, row[key])])
         hdulist = self.fits.HDUList()  # start creating the new HDU list
 
         data = convert_array(row["DATA"])  # , dtype=dtype)
+        if self.dtype is not None:
+            data = data.astype(self.dtype, copy=False)
         # dtype = np.float32 if row["BITPIX"] == -32 else np.float64  # BITPIX shows if floats are 32 or 64 bit long
         # if row["BITPIX"] == -32:
         #     data = data.byteswap()  # change endianness only if 32-bit floats
@@ -477,6 +791,90 @@ class DB(Files):
         return hdulist
 
 
+def headers_table_command(table, columns=()):
+    """
+    :param table: name of the table
+    :param columns: list of (name, type) of the header keywords, besides base_columns
+    :return: the CREATE TABLE statement of the headers table
+    """
+    return 'CREATE TABLE IF NOT EXISTS {0} ('.format(table) + \
+           ', '.join('"{0}" {1}'.format(name, type_) for name, type_ in base_columns + list(columns)) + ');'
+
+
+def sql_type(value):
+    """
+    :param value: a header value
+    :return: the SQLite type of a column for such values: INTEGER, REAL, TEXT, or NUMERIC if value is None
+    """
+    if isinstance(value, (bool, int, np.integer, np.bool_)):
+        return 'INTEGER'
+    if isinstance(value, (float, np.floating)):
+        return 'REAL'
+    if isinstance(value, str):
+        return 'TEXT'
+    return 'NUMERIC'
+
+
+def column_affinity(declared_type):
+    """
+    :param declared_type: the type of a column as in its declaration
+    :return: the type SQLite gives its values (see "Type Affinity" in the SQLite documentation):
+             INTEGER, TEXT, BLOB, REAL or NUMERIC
+    """
+    declared_type = declared_type.upper()
+    if 'INT' in declared_type:
+        return 'INTEGER'
+    if any(name in declared_type for name in ['CHAR', 'CLOB', 'TEXT']):
+        return 'TEXT'
+    if 'BLOB' in declared_type or not declared_type:
+        return 'BLOB'
+    if any(name in declared_type for name in ['REAL', 'FLOA', 'DOUB']):
+        return 'REAL'
+    return 'NUMERIC'
+
+
+def to_number(value):
+    """
+    :param value: string
+    :return: the int or float the string stands for, or the string itself
+    """
+    for type_ in (int, float):
+        try:
+            return type_(value)
+        except ValueError:
+            pass
+    return value
+
+
+def file_info(file, content_hash=False):
+    """
+    :param file: filename
+    :param content_hash: compute the SHA-1 hash of the content
+    :return: tuple of the absolute path, the size, the modification time and the hash (or None)
+    """
+    stat = os.stat(file)
+    digest = None
+    if content_hash:
+        sha1 = hashlib.sha1()
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(2 ** 20), b''):
+                sha1.update(block)
+        digest = sha1.hexdigest()
+    return os.path.abspath(file), stat.st_size, stat.st_mtime, digest
+
+
+_parser = None  # the Files object of a worker process of parse_files
+
+
+def _init_parser(debug, dtype):
+    global _parser
+    _parser = Files(None, debug, False, dtype)
+
+
+def _parse_file(file):
+    return _parser.parse_file(file)
+
+
 def log_sql_stmt(cursor, sql, *args):
     if len(args) > 0:
         # generates SELECT quote(?), quote(?), ...
@@ -5,6 +5,7 @@ from __future__ import print_function
 from fitsdb import sqlite
 from arcfinder import computing
 from arcfinder import plotting
+from arcfinder import cache
 
 import argparse
 from collections import OrderedDict
@@ -31,6 +32,10 @@ def parse_args():
                                      ' --attr MJD "51000 52000"',
                              "nargs": 2}],
         [["--attr-list"],   {"help": 'get a list of available attributes',
+                             "action": "store_true"}],
+        [["--substring"],   {"help": 'match single text values anywhere (case-insensitive, slow); by default they '
+                                     'match the beginning of the value (e.g. "B0834" matches "B0834+06"), '
+                                     'or the whole value if they start with "="',
                              "action": "store_true"}]
         ]
 
@@ -41,6 +46,15 @@ def parse_args():
     ingest = subparsers.add_parser('ingest', help='ingest files')
     ingest.set_defaults(subcmd='ingest')
     ingest.add_argument('files', help='filenames, e.g. "dir/*.fits"', nargs='+')
+    ingest.add_argument('--batch-size', type=int, default=100,
+                        help='number of files ingested per transaction (default: 100)')
+    ingest.add_argument('-j', '--workers', type=int, default=1,
+                        help='number of processes parsing the files (default: 1)')
+    ingest.add_argument('--force', action="store_true",
+                        help='ingest all files, also those unchanged since they were ingested (same path, size and '
+                             'modification time)')
+    ingest.add_argument('--hash', action="store_true",
+                        help='store a hash of the content of the files and skip only files with the same hash')
 
     sql = subparsers.add_parser('sql', help='SQL-Statement to query, e.g. "SELECT * FROM headers")')
     sql.set_defaults(subcmd='sql')
@@ -67,15 +81,45 @@ def parse_args():
                                              '"matrix" (with separate file for axes) or "gnuplot"')
     plot.add_argument('--cmap', help='Choose the colormap from the matplotlib palette, default is "viridis"')
     plot.add_argument('-w', '--write-files', action="store_true", help='write the rows from the DB back to the files')
+    plot.add_argument('--batch-size', type=int, default=8,
+                      help='number of observations whose secondary spectra are computed together (default: 8)')
+    plot.add_argument('--max-ram', type=float, help='compute the secondary spectra out of core, with chunks of at '
+                                                    'most this many MB (for spectra larger than the memory)')
+    plot.add_argument('--tmp-dir', help='directory for the temporary files of --max-ram')
     # query.add_argument('--parabola', action="store_true", help='parabola fitting of the secondary spectrum')
     # query.add_argument('--maxt', help='maximum thickness of the parabola (default: 5)')
 
+    cache_cmd = subparsers.add_parser('cache', help='Show or clean the cache of secondary spectra (see --cache-dir)')
+    cache_cmd.set_defaults(subcmd='cache')
+    cache_cmd.add_argument('--invalidate', metavar='PATTERN',
+                           help='remove the entries whose filename matches the pattern, e.g. "*B0834*"')
+    cache_cmd.add_argument('--clear', action="store_true", help='remove all entries')
+
+    compact = subparsers.add_parser('compact', help='Migrate the database to a compact headers table: drop the columns '
+                                                    'without values and type the others after their values')
+    compact.set_defaults(subcmd='compact')
+
     positional = parser.add_mutually_exclusive_group(required='True')
     positional.add_argument('-b', '--db', action="store_true", help='switch for using a sqlite database')
     positional.add_argument('-f', action="store_true", help='switch for using local files')
     parser.add_argument('file', help='path to the file(s)', nargs='+')
     parser.add_argument('-v', '--verbose', action="store_true", help='enable verbose mode')
     parser.add_argument('--debug', action="store_true", help='enable debug mode')
+    parser.add_argument('--fft-backend', choices=computing.fft_backends,
+                        help='FFT library for the secondary spectra (default: the first one installed of {0})'
+                             .format(', '.join(computing.fft_backends)))
+    parser.add_argument('--fft-workers', type=int, help='number of threads per FFT, -1 for all CPUs (default: 1)')
+    parser.add_argument('--fft-pad', action="store_true",
+                        help='compute FFTs of awkward lengths with zero-padded FFTs of fast lengths '
+                             '(Bluestein\'s algorithm: same result, more memory)')
+    parser.add_argument('--cache-dir', help='keep the computed secondary spectra in this directory and reuse them')
+    parser.add_argument('--cache-size', type=float, default=2048.,
+                        help='maximum size of the cache in MB, the least recently used entries are removed '
+                             '(default: 2048)')
+    parser.add_argument('--precision', choices=sorted(computing.precisions),
+                        help='floating point precision of the spectra and of newly ingested data (default: double); '
+                             'single halves the memory, the secondary spectra differ by about 1e-4 dB '
+                             '(see computing.precision_check)')
     args = parser.parse_args()
     if args.debug:
             print(args)
@@ -136,7 +180,7 @@ def get_data(db, files, args):
 
     result = []
     if args.db:
-        result = db.extract(attr_dict, args.write_files)
+        result = db.extract(attr_dict, args.write_files, args.substring)
     elif args.f:
         result = files.files
 
@@ -156,6 +200,26 @@ def get_data(db, files, args):
     return outp, attr_dict, result
 
 
+def get_observations(args, files, result):
+    """
+    Generates the arguments for computing.Dynamic/Secondary from the results of get_data.
+    Database results are released from the list once they are handed out.
+    :return: generator of (hdulist, header, filename, rotate) tuples
+    """
+    for i, res in enumerate(result):
+        if args.db:
+            hdulist = res[0]
+            header = {key: res[1][key] for key in res[1].keys() if key != 'DATA'}  # the data is in hdulist
+            filename = header['filename']
+            rotate = True
+            result[i] = None
+        elif args.f:
+            hdulist, header, data = files.get_data(res)
+            filename = res
+            rotate = True if not args.write_files else False
+        yield hdulist, header, filename, rotate
+
+
 def tabular_output(args, filename, outp, header):
     text = ''
     if args.f:
@@ -174,20 +238,63 @@ def main(args):
     """
     db = None
     files = None
+    computing.set_fft_backend(args.fft_backend, args.fft_workers, args.fft_pad)
+    if args.debug:
+        print('FFT backend', computing.get_fft_backend())
+        computing.preprocessing_profile = True
+    dtype = None  # double precision keeps the data as it is
+    if args.precision:
+        computing.set_precision(args.precision)
+        if args.precision == 'single':
+            dtype = computing.real_dtype()
+    if args.cache_dir:
+        computing.secondary_cache = cache.SecondaryCache(args.cache_dir, int(args.cache_size * 1024 ** 2))
     if args.db:
-        db = sqlite.DB(args.file, args.debug, args.verbose)
+        db = sqlite.DB(args.file, args.debug, args.verbose, dtype)
     elif args.f:
-        files = sqlite.Files(args.file, args.debug, args.verbose)
+        files = sqlite.Files(args.file, args.debug, args.verbose, dtype)
     if args.subcmd == 'ingest':
         file_list = db.get_file_list(args.files)
         if have_astropy and len(file_list) > 3:
-            file_list = db.get_file_list(args.files)
             with astropy.utils.console.ProgressBar(len(file_list)) as bar:
-                for i in range(len(file_list)):
-                    bar.update()
-                    db.ingest_data([file_list[i]])
+                failed = db.ingest_data(file_list, args.batch_size, lambda done, total: bar.update(done), args.workers,
+                                        args.force, args.hash)
         else:
-            db.ingest_data(args.files)
+            failed = db.ingest_data(file_list, args.batch_size, workers=args.workers, force=args.force,
+                                    content_hash=args.hash)
+        if db.unchanged:
+            print('\nSkipped {0} unchanged files (use --force to ingest them anyway)'.format(len(db.unchanged)))
+        if failed:
+            print('\n{0} of {1} files could not be ingested:'.format(len(failed), len(file_list)))
+            for filename, error in failed:
+                print(' {0}: {1}'.format(filename, error))
+    elif args.subcmd == 'cache':
+        secondary_cache = computing.secondary_cache
+        if secondary_cache is None:
+            raise argparse.ArgumentError(None, 'The cache subcommand needs --cache-dir')
+        if args.clear:
+            print('Removed {0} entries'.format(secondary_cache.invalidate()))
+        elif args.invalidate:
+            print('Removed {0} entries'.format(secondary_cache.invalidate(args.invalidate)))
+        entries = secondary_cache.entries()
+        print('{0} entries, {1:.1f} of {2:.1f} MB'.format(len(entries), sum(e[1] for e in entries) / 1024 ** 2,
+                                                         secondary_cache.max_size / 1024 ** 2))
+        if args.verbose:
+            for key, size, _ in entries:
+                filename = secondary_cache.info(key).get('filename')
+                print(' {0} | {1:8.1f} MB | {2}'.format(key, size / 1024 ** 2, filename))
+    elif args.subcmd == 'compact':
+        if db is None:
+            raise argparse.ArgumentError(None, 'The compact subcommand needs a database (-b)')
+        result = db.compact()
+        print('Dropped {0} empty columns, changed the type of {1} columns; {2:.1f} MB -> {3:.1f} MB'.format(
+            len(result['dropped']), len(result['retyped']), result['size'][0] / 1024 ** 2,
+            result['size'][1] / 1024 ** 2))
+        if args.verbose:
+            for column in result['dropped']:
+                print(' dropped {0}'.format(column))
+            for column, type_ in result['retyped'].items():
+                print(' {0}: {1}'.format(column, type_))
     elif args.subcmd == 'sql':
         for row in db.sql(args.sql):
             print(tuple(row))
@@ -259,31 +366,35 @@ def main(args):
         pdf = None
         if args.pdf:
             pdf = plotting.Pdf(attr_dict)
-        for res in result:
-            if args.db:
-                hdulist = res[0]
-                header = res[1]
-                filename = header['filename']
-                rotate = True
-            elif args.f:
-                hdulist, header, data = files.get_data(res)
-                filename = res
-                rotate = True if not args.write_files else False
-
+        if args.sec and args.max_ram:
+            objects = (computing.Secondary(*observation) for observation in get_observations(args, files, result))
+        elif args.sec:  # the secondary spectra of batch_size observations are computed together
+            objects = computing.iter_secondaries(get_observations(args, files, result), args.batch_size,
+                                                 keep_dynamic=args.dyn)
+        else:
+            objects = (computing.Dynamic(*observation) for observation in get_observations(args, files, result))
+        for obj in objects:
             # text output
-            tabular_output(args, filename, outp, header)
+            tabular_output(args, obj.filename, outp, obj.db_header)
 
             # Plotting:
             if args.dyn and not args.sec:  # only plot dynamic
-                dyn = computing.Dynamic(hdulist, header, filename, rotate)
-                plotting.show_dyn(dyn, args.store, args.format, pdf)
+                plotting.show_dyn(obj, args.store, args.format, pdf)
             elif args.sec:
-                sec = computing.Secondary(hdulist, header, filename, rotate)
                 if args.dyn:  # plot dynamic first
-                    plotting.show_dyn(sec, args.store, args.format, pdf)
-                plotting.show_sec(sec, args.store, args.format, pdf)
+                    plotting.show_dyn(obj, args.store, args.format, pdf)
+                if args.max_ram:  # computed from the raw data, the dynamic spectrum isn't needed
+                    obj.drop_dynamic()
+                    obj.get_secondary_spectrum_out_of_core(ram_limit=int(args.max_ram * 1024 ** 2),
+                                                           workdir=args.tmp_dir)
+                obj.drop_dynamic(drop_raw=True)  # only the secondary spectrum is needed from here on
+                plotting.show_sec(obj, args.store, args.format, pdf)
             else:
                 raise argparse.ArgumentError('plot', 'Unrecognized plot type')
+            if args.debug:
+                for stage in obj.preprocessing_report:
+                    print('{0}: {1:.3f} s, {2:.1f} MB'.format(stage['stage'], stage['seconds'],
+                                                              stage['peak_bytes'] / 1024. ** 2))
             if not args.store:  # don't plot to screen when storing images
                 plotting.show()
             # end for-loop
@@ -0,0 +1,46 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # for "import functions"
+
+
+def observation(nchan=64, nsub=96, seed=0, non_values=True):
+    """
+    a seeded synthetic observation (subintegrations x channels, float32 like the FITS files),
+    with interfering fringes, a row of zeros and a NaN
+    :return: astropy HDUList with the header keywords that Dynamic and Secondary use
+    """
+    from astropy.io import fits
+    rng = np.random.default_rng(seed)
+    t, f = np.meshgrid(np.linspace(0., 1., nsub), np.linspace(0., 1., nchan), indexing='ij')
+    dynamic = 1. + 0.2 * rng.normal(size=(nsub, nchan))
+    for _ in range(12):
+        ft, ff = rng.uniform(-20., 20.), rng.uniform(-30., 30.)
+        dynamic += 0.3 * np.cos(2. * np.pi * (ft * t + 0.5 * ft ** 2 * f + ff * f))
+    dynamic = np.abs(dynamic).astype(np.float32)
+    if non_values:
+        dynamic[3, :] = 0.
+        dynamic[10, 5] = np.nan
+    header = fits.Header()
+    for key, value in [('T_INT', 3600.), ('FREQ', 1400.), ('BW', 64.), ('MJD', 55000.)]:
+        header[key] = value
+    return fits.HDUList([fits.PrimaryHDU(data=dynamic, header=header)])
+
+
+@pytest.fixture
+def make_observation():
+    return observation
+
+
+@pytest.fixture
+def precision():
+    """
+    restores the precision of computing after the test
+    """
+    from arcfinder import computing
+    previous = computing.precision
+    yield computing.set_precision
+    computing.set_precision(previous)
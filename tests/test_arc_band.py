@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from arcfinder.multiprocessing_helper_functions import SecondaryView, arc_band, arc_weights, crunchy_etas
+
+
+def make_view(y_axis, x_axis, seed=0):
+    rng = np.random.default_rng(seed)
+    data = rng.random((len(y_axis), len(x_axis)))
+    data[rng.random(data.shape) < 0.01] = np.nan
+    return SecondaryView(data, y_axis, x_axis)
+
+
+# ascending and descending y axes, with and without the origin inside the image
+axes = [
+    (np.linspace(0., 5., 64), np.linspace(-4., 4., 81)),
+    (np.linspace(5., 0., 64), np.linspace(-4., 4., 81)),
+    (np.linspace(0.3, 2., 40), np.linspace(-1., 3., 57)),
+]
+# small etas keep the arc near the bottom of the image, large ones make it leave through the top
+etas = [0.01, 0.1, 0.5, 1., 3., 20.]
+sigmas = [None, [0.2, 0.05], [0.02, 0.3]]
+
+
+@pytest.mark.parametrize('y_axis, x_axis', axes)
+@pytest.mark.parametrize('sigma', sigmas)
+def test_band_matches_dense(y_axis, x_axis, sigma):
+    sec = make_view(y_axis, x_axis)
+    banded = crunchy_etas(etas, sec, sigma=sigma, band=True)
+    dense = crunchy_etas(etas, sec, sigma=sigma, band=False)
+    assert [eta for eta, _ in banded] == etas
+    np.testing.assert_allclose([p for _, p in banded], [p for _, p in dense], rtol=1e-12)
+
+
+@pytest.mark.parametrize('y_axis, x_axis', axes)
+@pytest.mark.parametrize('sigma', [[0.08, 0.1], [0.2, 0.05], [0.02, 0.3]])
+@pytest.mark.parametrize('eta', etas + [-1.])
+def test_band_contains_weighted_pixels(y_axis, x_axis, sigma, eta):
+    weights = arc_weights(eta, x_axis[np.newaxis, :], y_axis[:, np.newaxis], sigma)
+    band = np.zeros(weights.shape, dtype=bool)
+    rows, cols = arc_band(eta, y_axis, x_axis, sigma)
+    band[rows, cols] = True
+    assert len(rows) == np.count_nonzero(band)  # no pixel twice
+    assert not np.any((weights != 0) & ~band)
+    # the band also reaches the pixels at the edges of the image
+    assert np.all(band[weights[:, 0] != 0, 0])
+    assert np.all(band[weights[:, -1] != 0, -1])
+    assert np.all(band[0, weights[0] != 0])
+    assert np.all(band[-1, weights[-1] != 0])
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from arcfinder.multiprocessing_helper_functions import SecondaryView, crunchy3, crunchy3_grid
+
+
+def arc_view(y_axis, x_axis, eta=1.5, offset=-0.5, seed=0):
+    """
+    noise with a shifted arc and a few NaNs
+    """
+    rng = np.random.default_rng(seed)
+    x, y = np.meshgrid(x_axis, y_axis)
+    data = rng.random(x.shape) + 5. * np.exp(-(y - eta * ((x - offset) ** 2 - offset ** 2)) ** 2 / 0.02)
+    data[rng.random(data.shape) < 0.01] = np.nan
+    return SecondaryView(data, y_axis, x_axis)
+
+
+axes = [
+    (np.linspace(4., 0., 64), np.linspace(-4., 4., 128)),
+    (np.linspace(0., 4., 33), np.linspace(-4., 4., 47)),
+    (np.linspace(4., 0.2, 50), np.linspace(-3., 1., 61)),
+]
+offsets = np.linspace(-2., 2., 9) + 0.013  # not whole pixels
+etas = [0.3, 1., 2., 3.]
+
+
+@pytest.mark.parametrize('y_axis, x_axis', axes)
+@pytest.mark.parametrize('sigma', [None, [0.2, 0.1]])
+def test_grid_matches_crunchy3(y_axis, x_axis, sigma):
+    sec = arc_view(y_axis, x_axis)
+    plane = crunchy3_grid(offsets, etas, sec, sigma)
+    expected = [[crunchy3(offset, eta, sec, sigma)[1] for eta in etas] for offset in offsets]
+    np.testing.assert_allclose(plane, expected, rtol=1e-12)
+    np.testing.assert_allclose(crunchy3_grid(offsets, etas, sec, sigma, band=False), expected, rtol=1e-12)
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from arcfinder import computing
+
+# in decibels; single precision differs from the in-memory path by the round-off of the FFTs
+tolerances = {'double': 1e-10, 'single': 1e-4}
+
+
+@pytest.mark.parametrize('prec', ['double', 'single'])
+@pytest.mark.parametrize('seed, rotate', [(0, False), (1, True)])
+@pytest.mark.parametrize('nchan, nsub', [(64, 96), (63, 97)])
+@pytest.mark.parametrize('ram_limit', [2 ** 30, 2 ** 14, 2 ** 11])  # one chunk, a few rows, a row at a time
+def test_out_of_core_matches_full_transform(make_observation, precision, tmp_path, prec, seed, rotate, nchan, nsub,
+                                            ram_limit):
+    precision(prec)
+    observation = make_observation(nchan=nchan, nsub=nsub, seed=seed)
+    expected = computing.Secondary(observation, {'filename': 'x'}, 'x', rotate).get_secondary_spectrum(
+        real_input=False)
+    # the raw data from a memory map, like a FITS file opened with memmap=True
+    np.save(str(tmp_path / 'raw.npy'), observation[0].data)
+    data = np.load(str(tmp_path / 'raw.npy'), mmap_mode='r')
+    report = []
+    result = computing.secondary_out_of_core(data, str(tmp_path / 'secondary.npy'), rotate, ram_limit,
+                                             str(tmp_path), report=report)
+    assert result.shape == expected.shape and result.dtype == expected.dtype
+    np.testing.assert_allclose(result, expected, rtol=0, atol=tolerances[prec])
+    assert [entry['stage'] for entry in report][0] == 'copy'
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['raw.npy', 'secondary.npy']  # temporaries removed
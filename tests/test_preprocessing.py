@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from arcfinder import computing, preprocessing
+
+
+def old_chain(data, rotate=False, normalize_frequency=False, normalize_time=True, outliers_sigma=9):
+    """
+    the cleaning of Dynamic.get_dynamic_spectrum before the preprocessing pipeline
+    """
+    dynamic = np.array(np.rot90(data) if rotate else data, dtype=computing.real_dtype())
+    dynamic, dyn_median = computing.repl_nonvals_wmed(dynamic)
+    dyn_med_std = np.std(dynamic - dyn_median)
+    np.copyto(dynamic, dyn_median, where=dynamic >= dyn_median + (float(outliers_sigma) * dyn_med_std))
+    if normalize_frequency:
+        dynamic = computing.arr_normalize_axis(dynamic, 'y')
+    if normalize_time:
+        dynamic = computing.arr_normalize_axis(dynamic, 'x')
+    return dynamic
+
+
+def raw_data(make_observation, seed):
+    data = make_observation(seed=seed)[0].data.copy()
+    data[20, 7] = 50.  # an outlier for the clipping
+    data[:, 11] = 0.  # a channel of zeros
+    data[30, 40:44] = np.nan
+    return data
+
+
+# the pipeline computes its statistics in double precision, the old chain in the current one
+tolerances = {'double': 1e-12, 'single': 2e-6}
+normalizations = [(False, True), (True, True), (True, False), (False, False)]
+
+
+@pytest.mark.parametrize('prec', ['double', 'single'])
+@pytest.mark.parametrize('rotate', [False, True])
+@pytest.mark.parametrize('normalize_frequency, normalize_time', normalizations)
+@pytest.mark.parametrize('chunked', [False, True])
+@pytest.mark.parametrize('block_size', [2 ** 18, 100])
+def test_pipeline_matches_old_chain(make_observation, precision, prec, rotate, normalize_frequency, normalize_time,
+                                    chunked, block_size):
+    precision(prec)
+    data = raw_data(make_observation, seed=3)
+    untouched = data.copy()
+    expected = old_chain(data, rotate, normalize_frequency, normalize_time)
+    pipeline = preprocessing.dynamic_pipeline(normalize_frequency, normalize_time, block_size=block_size,
+                                              chunked=chunked)
+    result = pipeline.run(data, rotate, computing.real_dtype())
+    assert result.dtype == expected.dtype and result.shape == expected.shape
+    assert np.all(np.isfinite(result))
+    np.testing.assert_allclose(result, expected, rtol=tolerances[prec], atol=tolerances[prec])
+    np.testing.assert_array_equal(data, untouched)
+
+
+@pytest.mark.parametrize('prec', ['double', 'single'])
+@pytest.mark.parametrize('rotate', [False, True])
+def test_get_dyn_matches_old_chain(make_observation, precision, prec, rotate):
+    precision(prec)
+    observation = make_observation(seed=4)
+    data = observation[0].data.copy()
+    dynamic = computing.Dynamic(observation, {'filename': 'x'}, 'x', rotate)
+    for parameters in [(), (True, False, 5)]:
+        expected = old_chain(data, rotate, *parameters)
+        np.testing.assert_allclose(dynamic.get_dyn(*parameters), expected, rtol=tolerances[prec],
+                                   atol=tolerances[prec])
+    np.testing.assert_array_equal(observation[0].data, data)
@@ -0,0 +1,59 @@
+import sqlite3
+
+import pytest
+
+from fitsdb.sqlite import DB
+
+rows = [
+    ('a.fits', '0735+34', 55000., 327),
+    ('b.fits', '0735+34', 55000.5, 1400),
+    ('c.fits', 'B0834+06', 55001., 1400),
+    ('d.fits', '0735', 55002., 430),
+]
+
+
+def make_baseline_db(path):
+    """
+    a database with the schema of the first version of DB: every keyword column is NUMERIC
+    """
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE headers (id INTEGER PRIMARY KEY, filename TEXT UNIQUE ON CONFLICT REPLACE, '
+                 'ctime DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP, '
+                 'mtime DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP, keywords TEXT DEFAULT NULL)')
+    conn.execute('CREATE TABLE astrodata (headers_id INTEGER REFERENCES headers(id) ON DELETE CASCADE, DATA BLOB)')
+    for column in ['SOURCE', 'MJD', 'FREQ']:
+        conn.execute('ALTER TABLE headers ADD "{0}" NUMERIC'.format(column))
+    for row in rows:
+        cursor = conn.execute('INSERT INTO headers (filename, SOURCE, MJD, FREQ) VALUES (?, ?, ?, ?)', row)
+        conn.execute('INSERT INTO astrodata (headers_id, DATA) VALUES (?, ?)', (cursor.lastrowid, b''))
+    conn.commit()
+    conn.close()
+
+
+def matches(db, attributes):
+    command, values = db.build_query(attributes)
+    db.cursor.execute(command, values)
+    return sorted(row['filename'] for row in db.cursor.fetchall())
+
+
+queries = [
+    ({'SOURCE': '0735'}, ['a.fits', 'b.fits', 'd.fits']),
+    ({'SOURCE': '=0735+34'}, ['a.fits', 'b.fits']),
+    ({'SOURCE': 'B08'}, ['c.fits']),
+    ({'MJD': '55000'}, ['a.fits']),
+    ({'MJD': '55000 55001'}, ['a.fits', 'b.fits', 'c.fits']),
+    ({'FREQ': '1400'}, ['b.fits', 'c.fits']),
+    ({'FREQ': '1400', 'MJD': '55000.5'}, ['b.fits']),
+    ({'filename': 'c'}, ['c.fits']),
+]
+
+
+@pytest.mark.parametrize('compact', [False, True])
+@pytest.mark.parametrize('attributes, expected', queries)
+def test_baseline_database(tmp_path, compact, attributes, expected):
+    path = str(tmp_path / 'baseline.sqlite')
+    make_baseline_db(path)
+    db = DB([path])
+    if compact:  # MJD becomes REAL and FREQ INTEGER; SOURCE stays NUMERIC, it holds '0735' as the number 735
+        db.compact()
+    assert matches(db, attributes) == expected
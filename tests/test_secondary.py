@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from arcfinder import computing
+
+# the default secondary spectra of two seeded observations in double precision, pinned when the
+# zero-delay row was left out of the statistics: mean, standard deviation and minimum in dB, and
+# some of the brightest pixels
+pinned = [
+    (0, False, (-29.20146416, 4.30712184, -32.59860523),
+     [(31, 8, -0.09987932), (47, 12, -0.44219155), (42, 22, -0.67391622), (29, 63, -1.80146624)]),
+    (1, True, (-27.26999365, 2.66635908, -28.2554965),
+     [(24, 45, -0.34427343), (16, 39, -0.36059738), (6, 52, -1.10824592), (26, 60, -2.93074143)]),
+]
+
+
+@pytest.mark.parametrize('real_input', [True, False])
+@pytest.mark.parametrize('seed, rotate, statistics, pixels', pinned)
+def test_secondary_spectrum_is_pinned(make_observation, precision, seed, rotate, statistics, pixels, real_input):
+    precision('double')
+    sec = computing.Secondary(make_observation(seed=seed), {'filename': 'x'}, 'x', rotate)
+    secondary = np.asarray(sec.get_secondary_spectrum(real_input=real_input), dtype=float)
+    np.testing.assert_allclose([np.mean(secondary), np.std(secondary), np.min(secondary)], statistics, atol=1e-7)
+    np.testing.assert_allclose([secondary[i, j] for i, j, _ in pixels], [value for _, _, value in pixels], atol=1e-7)
+
+
+@pytest.mark.parametrize('seed, rotate', [(0, False), (1, True), (2, True)])
+def test_precision_check(make_observation, precision, seed, rotate):
+    precision('double')
+    result = computing.precision_check(make_observation(seed=seed), {'filename': 'x'}, np.linspace(0.01, 2., 60), 'x',
+                                       rotate)
+    assert result['ok'], result
+    assert result['db_error'] < 1e-3
+    assert computing.precision == 'double'  # precision_check restores it
+
+
+@pytest.mark.parametrize('prec, tolerance', [('double', 1e-10), ('single', 1e-4)])
+@pytest.mark.parametrize('seed, rotate', [(0, False), (1, True)])
+@pytest.mark.parametrize('nchan, nsub', [(64, 96), (63, 97)])
+@pytest.mark.parametrize('parameters', [{}, {'subtract_secondary_background': False},
+                                        {'normalize_frequency': False, 'normalize_time': False},
+                                        {'xscale': 2., 'yscale': 1.5}])
+def test_half_plane_matches_full_transform(make_observation, precision, prec, tolerance, seed, rotate, nchan, nsub,
+                                           parameters):
+    precision(prec)
+    sec = computing.Secondary(make_observation(nchan=nchan, nsub=nsub, seed=seed), {'filename': 'x'}, 'x', rotate)
+    half = sec.get_secondary_spectrum(real_input=True, **parameters)
+    full = sec.get_secondary_spectrum(real_input=False, **parameters)
+    assert half.shape == full.shape and half.dtype == full.dtype and half.size
+    np.testing.assert_allclose(half, full, rtol=0, atol=tolerance)